@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from locations import LocationBatch
+from http_cache import response_cache
+from scrape import BUNDLE_SEARCH_CACHE_TTL, BUNDLE_SEARCH_URL, bundle_search_params, location_collector
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Async token bucket allowing `rate` requests per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BundleSearchClient:
+    """
+    Bundle search client issuing up to `concurrency` requests at once over a shared keep-alive
+    connection pool, throttled by a token bucket and retrying transient failures with exponential backoff.
+    """
+
+    def __init__(self, base_url=BUNDLE_SEARCH_URL, concurrency=8, rate=5.0, retries=3, backoff=0.5, timeout=10,
+                 cache_ttl=BUNDLE_SEARCH_CACHE_TTL):
+        self.base_url = base_url
+        self.cache_ttl = cache_ttl
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+    async def fetch(self, text, polygon_param, selected_sub_category, camera):
+        """Fetch one bundle search response; returns {} when it keeps failing, like fetch_bundle_search_data."""
+        params = bundle_search_params(text, polygon_param, selected_sub_category, camera)
+        cached = response_cache.get(self.base_url, params, self.cache_ttl)
+        if cached is not None:
+            return cached
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                await self.bucket.acquire()
+                try:
+                    response = await loop.run_in_executor(
+                        self.executor, lambda: self.http.get(self.base_url, params=params, timeout=self.timeout))
+                except requests.RequestException as e:
+                    logger.warning(f"Bundle search request failed ({e}), attempt {attempt + 1}.")
+                else:
+                    if response.status_code == 200:
+                        payload = response.json()
+                        await loop.run_in_executor(self.executor, response_cache.put, self.base_url, params, payload)
+                        return payload
+                    if response.status_code not in RETRY_STATUSES:
+                        return {}
+                    logger.warning(f"Bundle search returned {response.status_code}, attempt {attempt + 1}.")
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+        return {}
+
+    def close(self):
+        self.http.close()
+        self.executor.shutdown(wait=False)
+
+
+async def scrape_cells_async(session, cells, slug, category, sub_category, base_url=BUNDLE_SEARCH_URL,
+                             concurrency=8, rate=5.0, progress=None, split=None, checkpoint=None):
+    """
+    Concurrent counterpart of scrape.scrape_cells with the same arguments and return value.
+
+    The locations of each response are written as soon as it arrives rather than in cell order, on a
+    writer thread so the inserts never stall the requests in flight. Cells returned by split are
+    scheduled as soon as their parent's response is in, and a checkpoint is honoured the same way.
+    """
+    search_results = []
+    cache_ttl = BUNDLE_SEARCH_CACHE_TTL
+    if checkpoint is not None:
+        cells = checkpoint.pending(cells)
+        cache_ttl = checkpoint.cache_ttl(cache_ttl)
+    client = BundleSearchClient(base_url, concurrency=concurrency, rate=rate, cache_ttl=cache_ttl)
+
+    # A single writer thread: the session must not be used concurrently, and responses are stored in arrival order
+    writer = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+
+    async def fetch(cell):
+        return cell, await client.fetch(slug, '', sub_category, cell.get("centroid"))
+
+    try:
+        with LocationBatch(session) as batch:
+            collect = location_collector(batch, category, sub_category, search_results)
+
+            def store(bundle_data):
+                collect(bundle_data)
+                batch.flush()
+
+            pending = {asyncio.ensure_future(fetch(cell)) for cell in cells}
+            done = 0
+            while pending:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    cell, bundle_data = task.result()
+                    await loop.run_in_executor(writer, store, bundle_data)
+                    children = split(cell, bundle_data) if split is not None else []
+                    pending |= {asyncio.ensure_future(fetch(child)) for child in children}
+                    if checkpoint is not None:
+                        checkpoint.mark_done(cell, children)  # The cell's locations are already written
+                    done += 1
+                    if progress is not None:
+                        progress(done, done + len(pending), search_results)
+    finally:
+        client.close()
+        writer.shutdown()
+    if checkpoint is not None:
+        checkpoint.save()
+    return search_results, {"inserted": batch.inserted, "skipped": batch.skipped}
+
+
+def scrape_cells_concurrently(session, cells, slug, category, sub_category, base_url=BUNDLE_SEARCH_URL,
+                              concurrency=8, rate=5.0, progress=None, split=None, checkpoint=None):
+    """Run scrape_cells_async to completion from synchronous code (Streamlit pages, the CLI)."""
+    return asyncio.run(scrape_cells_async(session, cells, slug, category, sub_category, base_url=base_url,
+                                          concurrency=concurrency, rate=rate, progress=progress, split=split,
+                                          checkpoint=checkpoint))
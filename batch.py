@@ -0,0 +1,147 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from geoalchemy2.shape import to_shape, from_shape
+from shapely import Polygon
+from sqlalchemy import func
+
+from data_versions import DISTRICT_MARGIN
+from dbhandler import engine, session_scope
+from density import district_density
+from districts import District, BannedDistrict
+from heatmaps import Heatmap, HeatmapPoint
+from locations import Location
+from spatial import low_density_candidates
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def fetch_district_inputs(session, district_id):
+    """Load the district polygon and the banned zones intersecting it, once for the whole batch."""
+    district = session.get(District, district_id)
+    banned_districts = session.query(BannedDistrict).filter(
+        func.ST_Intersects(BannedDistrict.geom, district.geom)
+    ).all()
+    return Polygon(to_shape(district.geom)), [to_shape(bz.geom) for bz in banned_districts]
+
+
+def fetch_coords(session, district_polygon, subcategory):
+    """Coordinates of the existing businesses of a subcategory in (and around) the district."""
+    district_geom = from_shape(district_polygon, srid=4326)
+    rows = (
+        session.query(func.ST_X(Location.geom), func.ST_Y(Location.geom))
+        .filter(Location.subcategory == subcategory)
+        .filter(func.ST_DWithin(Location.geom, district_geom, DISTRICT_MARGIN))
+        .all()
+    )
+    return np.array(rows, dtype=float).reshape(-1, 2)
+
+
+def _init_worker():
+    # Forked workers must not reuse the parent's pooled connections
+    engine.dispose(close=False)
+
+
+def _generate_surface(task):
+    """Worker: fetch one subcategory's businesses with its own session and compute its heat-map surface."""
+    (category, subcategory, district_polygon, banned_polys, buffer_distance, percentile, density_engine,
+     kde_params) = task
+    result = {"category": category, "subcategory": subcategory, "businesses": 0, "locations": None,
+              "weights": None, "kde_info": None, "status": "no data"}
+    with session_scope() as session:
+        coords = fetch_coords(session, district_polygon, subcategory)
+    result["businesses"] = len(coords)
+    if len(coords) == 0:
+        return result
+
+    density, grid_coords, kde_info = district_density(coords, district_polygon, banned_polys, density_engine,
+                                                 kde_params=kde_params)
+    if density is None:
+        result["status"] = "no valid grid points"
+        return result
+
+    locations, weights = low_density_candidates(density, grid_coords, coords, percentile, buffer_distance)
+    if locations is None:
+        result["status"] = "no candidate locations"
+        return result
+
+    result.update(locations=locations, weights=weights, kde_info=kde_info, status="ok")
+    return result
+
+
+def generate_heatmaps_batch(session, district_id, subcategories, buffer_distance, percentile,
+                            density_engine="binned", workers=None, progress=None, kde_params=None):
+    """
+    Generate the heat maps of many subcategories of a district in parallel.
+
+    subcategories is a list of (category, subcategory) pairs. The district geometry and banned zones
+    are fetched once, the per-subcategory KDE work is fanned out over a process pool (each worker
+    opens its own session) and every resulting Heatmap is written with its points in a single commit.
+    progress is called as progress(done, total, result) after each subcategory finishes. kde_params
+    overrides the tree settings of the exact and approximate engines (see density.estimate_density).
+
+    Returns the list of per-subcategory results (without the surfaces) in completion order. A subcategory
+    that raises gets status "error" with the message in "error"; the other heat maps are still stored.
+    A subcategory listed again under another category is generated once and reported as "duplicate".
+    """
+    district_polygon, banned_polys = fetch_district_inputs(session, district_id)
+    session.rollback()  # End the read transaction so its connection goes back to the pool during the KDE runs
+
+    results = []
+    # Heat maps are unique per district/percentile/subcategory: a subcategory listed under several categories
+    # would compute the same surface twice and break the single commit on ix_heatmap_current
+    unique = {}
+    for category, subcategory in subcategories:
+        if subcategory in unique:
+            logger.warning(f"Subcategory '{subcategory}' is listed under '{unique[subcategory]}' and '{category}'; "
+                           f"generating it once.")
+            results.append({"category": category, "subcategory": subcategory, "businesses": 0,
+                            "status": "duplicate"})
+        else:
+            unique[subcategory] = category
+    tasks = [(category, subcategory, district_polygon, banned_polys, buffer_distance, percentile, density_engine,
+              kde_params) for subcategory, category in unique.items()]
+
+    heatmaps = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker) as executor:
+        futures = {executor.submit(_generate_surface, task): task for task in tasks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            category, subcategory = futures[future][:2]
+            try:
+                result = future.result()
+            except Exception as e:
+                # One failing subcategory (or a killed worker) must not lose the surfaces already computed
+                logger.error(f"Error generating the HeatMap of '{subcategory}': {e}", exc_info=True)
+                result = {"category": category, "subcategory": subcategory, "businesses": 0, "status": "error",
+                          "error": str(e)}
+            if result["status"] == "ok":
+                heatmap = Heatmap(district_id=district_id, category=result["category"],
+                                  subcategory=result["subcategory"], buffer_distance=buffer_distance,
+                                  percentile=percentile)
+                heatmap.set_surface(result["locations"], result["weights"], result["kde_info"]["grid_size"])
+                heatmap.record_kde(result["kde_info"])
+                heatmaps.append(heatmap)
+            summary = {key: result[key] for key in ("category", "subcategory", "businesses", "status", "error")
+                       if key in result}
+            results.append(summary)
+            if progress is not None:
+                progress(done, len(tasks), summary)
+
+    if not heatmaps:
+        return results
+    try:
+        for heatmap in heatmaps:
+            heatmap.supersede(session)
+        session.add_all(heatmaps)
+        session.flush()
+        HeatmapPoint.explode(session, [heatmap.id for heatmap in heatmaps])
+        session.commit()
+        logger.info(f"{len(heatmaps)} HeatMaps added successfully!")
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error adding HeatMaps: {e}", exc_info=True)
+        raise
+    return results
@@ -0,0 +1,69 @@
+"""
+Compare the per-point shapely masking loop against spatial.grid_mask.
+
+Run from the project root:  python -m benchmarks.grid_masking
+"""
+import time
+
+import numpy as np
+from shapely import Point
+from shapely.geometry import Polygon
+
+from spatial import build_grid, grid_mask
+
+CENTER = (35.71, 51.36)
+
+
+def irregular_polygon(center, radius, vertices=64, seed=0):
+    rng = np.random.default_rng(seed)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, vertices))
+    radii = radius * rng.uniform(0.7, 1.0, vertices)
+    return Polygon(np.column_stack([center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles)]))
+
+
+def banned_zones(district, count, seed=1):
+    rng = np.random.default_rng(seed)
+    min_lat, min_lon, max_lat, max_lon = district.bounds
+    size = (max_lat - min_lat) / 10
+    zones = []
+    for i in range(count):
+        lat, lon = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+        zones.append(irregular_polygon((lat, lon), size, vertices=12, seed=seed + i))
+    return zones
+
+
+def legacy_mask(grid_coords, district, banned_polys):
+    """The original two-pass loop from kde_module."""
+    mask = [district.contains(Point(lat, lon)) for lat, lon in grid_coords]
+    grid_coords = grid_coords[mask]
+    mask = []
+    for lat, lon in grid_coords:
+        point = Point(lat, lon)
+        in_district = district.contains(point)
+        in_banned = any(bp.contains(point) for bp in banned_polys)
+        mask.append(in_district and not in_banned)
+    return grid_coords[mask]
+
+
+def run(radii=(0.01, 0.02, 0.04, 0.08), banned_count=12, grid_size=0.001):
+    print(f"{'radius(deg)':>12} {'grid':>9} {'valid':>8} {'loop(s)':>9} {'vector(s)':>10} {'speedup':>8}")
+    for radius in radii:
+        district = irregular_polygon(CENTER, radius)
+        banned = banned_zones(district, banned_count)
+        grid_coords = build_grid(district.bounds, grid_size)
+
+        start = time.perf_counter()
+        expected = legacy_mask(grid_coords, district, banned)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = grid_coords[grid_mask(grid_coords, district, banned)]
+        vector_time = time.perf_counter() - start
+
+        assert np.array_equal(expected, result), "vectorized mask differs from the loop"
+        print(f"{radius:>12} {len(grid_coords):>9} {len(result):>8} {loop_time:>9.3f} {vector_time:>10.4f} "
+              f"{loop_time / vector_time:>7.0f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,64 @@
+"""
+Compare the HTML size and build time of the location suggestion map in both render modes.
+
+Run from the project root:  python -m benchmarks.map_rendering
+
+Builds a map like build_base_map + heatmap_module does (district outline, businesses, heat cells and the
+HeatMap plugin, or the PNG overlay in image mode) for synthetic districts of growing density, then
+serializes it with _repr_html_().
+Browser render time is not measured here; it follows the number of Leaflet objects, which drops
+from one per point to one per layer in geojson mode.
+"""
+import time
+
+import folium
+import numpy as np
+from folium.plugins import HeatMap
+from shapely import Polygon
+
+from map_layers import MAP_RENDER_MODES, add_business_layer, add_heat_cell_layer, add_surface_overlay, \
+    surface_overlay
+from spatial import build_grid, grid_mask
+
+CENTER = (35.71, 51.36)
+
+
+def synthetic_district(businesses, half_size, seed=0):
+    rng = np.random.default_rng(seed)
+    district = Polygon([(CENTER[0] - half_size, CENTER[1] - half_size), (CENTER[0] + half_size, CENTER[1] - half_size),
+                        (CENTER[0] + half_size, CENTER[1] + half_size), (CENTER[0] - half_size, CENTER[1] + half_size)])
+    coords = rng.uniform(np.subtract(CENTER, half_size), np.add(CENTER, half_size), (businesses, 2))
+    names = [f"Business {i}" for i in range(businesses)]
+    grid_coords = build_grid(district.bounds)
+    cells = grid_coords[grid_mask(grid_coords, district, [])]
+    return district, coords, names, cells, rng.random(len(cells))
+
+
+def build_map(district, coords, names, cells, weights, mode):
+    city_map = folium.Map(location=CENTER, zoom_start=12)
+    district_group = folium.FeatureGroup(name="District").add_to(city_map)
+    folium.Polygon(locations=list(district.exterior.coords), color="grey", weight=1, fill=True,
+                   fill_opacity=0.3).add_to(district_group)
+    add_business_layer(folium.FeatureGroup(name="Locations").add_to(city_map), coords, names, mode)
+    heatmap_group = folium.FeatureGroup(name='Heatmap').add_to(city_map)
+    if mode == "image":
+        add_surface_overlay(heatmap_group, *surface_overlay(cells, weights, 0.001))
+    else:
+        add_heat_cell_layer(heatmap_group, cells, weights, mode)
+        HeatMap(np.round(np.column_stack([cells, weights]), 6).tolist(), control=True).add_to(city_map)
+    return city_map
+
+
+def main():
+    for businesses, half_size in [(200, 0.02), (1000, 0.04), (5000, 0.06)]:
+        district, coords, names, cells, weights = synthetic_district(businesses, half_size)
+        print(f"{businesses} businesses, {len(cells)} heat cells")
+        for mode in MAP_RENDER_MODES:
+            start = time.perf_counter()
+            html = build_map(district, coords, names, cells, weights, mode)._repr_html_()
+            elapsed = time.perf_counter() - start
+            print(f"  {mode:>8}: {len(html) / 1e6:7.2f} MB  {elapsed:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,98 +1,225 @@
-import json
-
 import folium
+import folium.plugins
 import pandas as pd
 import streamlit as st
 import numpy as np
 from folium.plugins import HeatMap
-from scipy.spatial.distance import cdist
-from shapely import MultiPoint, Point, Polygon
-from geoalchemy2.shape import to_shape
-from sqlalchemy import func
-from sqlalchemy.orm import sessionmaker
+from shapely import Polygon
+from sqlalchemy import func, select, true
 from streamlit_folium import st_folium, folium_static
 
 from categories import fetch_categories
-from dbhandler import engine, db_handler
+from dbhandler import db_handler, session_scope
 from districts import select_district
-from heatmaps import Heatmap
-from location_suggestion import generate_heatmap
+from heatmaps import Heatmap, HeatmapPoint, load_surface_overlay
+from heatmap_index import HeatmapIndex, MAX_SUGGESTION_DISTANCE
+from density import DENSITY_ENGINES, select_kde_params
+from batch import generate_heatmaps_batch
+from spatial import build_grid, grid_mask
+from map_layers import add_surface_overlay
 
 
-def fetch_all_heatmaps(district):
-    """Fetch all heatmaps from the database."""
+def fetch_all_heatmaps(district_id):
+    """Fetch the current heatmap of every subcategory of the district from the database."""
     session = db_handler()
 
-    subquery = (
-        session.query(
-            Heatmap.subcategory,
-            func.max(Heatmap.id).label('max_id')
-        )
-        .filter(Heatmap.district_id == district.id)
-        .filter(Heatmap.percentile == 100)
-        .group_by(Heatmap.subcategory)
-        .subquery()
-    )
-
     heatmaps = (
         session.query(Heatmap)
-        .join(
-            subquery,
-            (Heatmap.subcategory == subquery.c.subcategory) &
-            (Heatmap.id == subquery.c.max_id)
-        )
+        .filter(Heatmap.district_id == district_id)
+        .filter(Heatmap.percentile == 100)
+        .filter(Heatmap.is_current.is_(True))
         .all()
     )
-    # heatmaps = session.query(Heatmap).filter(Heatmap.district == district).filter(Heatmap.percentile == 100).all()
 
     session.close()
 
     return heatmaps
 
 
+def latest_heatmap_id(district_id):
+    """Id of the newest current heat map of the district, used to invalidate the index."""
+    session = db_handler()
+    latest_id = (
+        session.query(func.max(Heatmap.id))
+        .filter(Heatmap.district_id == district_id)
+        .filter(Heatmap.percentile == 100)
+        .filter(Heatmap.is_current.is_(True))
+        .scalar()
+    )
+    session.close()
+    return latest_id
+
+
+@st.cache_resource(max_entries=16)
+def build_heatmap_index(district_id, latest_id):
+    """Index the district's heat maps; a new latest_id (a newly stored heat map) builds a fresh index."""
+    return HeatmapIndex(fetch_all_heatmaps(district_id))
+
+
+def load_heatmap_index(district_id):
+    return build_heatmap_index(district_id, latest_heatmap_id(district_id))
+
+
 def evaluate_business_potential(selected_location, heatmaps):
     """Evaluate business potential for each subcategory at the selected location."""
-    results = {}
-    for heatmap in heatmaps:
-        multipoint = to_shape(heatmap.geom)
-        weights = heatmap.weights
-
-        # Check if the selected location is within the heatmap's points
-        if isinstance(multipoint, MultiPoint):
-            points = np.array([[point.x, point.y] for point in multipoint.geoms])
-        else:
-            points = np.array([[multipoint.x, multipoint.y]])
-
-        # Calculate the distance between the selected location and all points in the heatmap
-        distances = np.linalg.norm(points - selected_location, axis=1)
-        closest_point_index = np.argmin(distances)
-        closest_point_density = weights[closest_point_index]
-        distance = cdist([selected_location.tolist()],
-                         [[points[closest_point_index][0], points[closest_point_index][1]]], metric='euclidean')
-        if distance > 0.0007:
-            continue
-
-        # Store the result for this subcategory
-        if heatmap.subcategory not in results.keys():
-            results[heatmap.subcategory] = [closest_point_density, points[closest_point_index], heatmap.id]
-        elif results[heatmap.subcategory][0] < closest_point_density:
-            results[heatmap.subcategory] = [closest_point_density, points[closest_point_index], heatmap.id]
-    return results
-
-
-def suggest_best_subcategories(selected_location, district):
+    return HeatmapIndex(heatmaps).evaluate(selected_location)
+
+
+def evaluate_business_potential_server_side(selected_location, district_id,
+                                            max_distance=MAX_SUGGESTION_DISTANCE):
+    """
+    Same result as evaluate_business_potential, computed in PostGIS: for the latest heat map of each
+    subcategory, a KNN (<->) query over its exploded heatmap_point rows returns only the closest point
+    within max_distance, so no surface is transferred to Python.
+    """
+    location = func.ST_SetSRID(func.ST_MakePoint(float(selected_location[0]), float(selected_location[1])), 4326)
+
+    latest = (
+        select(Heatmap.id, Heatmap.subcategory, Heatmap.kde_engine)
+        .filter(Heatmap.district_id == district_id)
+        .filter(Heatmap.percentile == 100)
+        .filter(Heatmap.is_current.is_(True))
+        .subquery()
+    )
+    nearest = (
+        select(HeatmapPoint.weight, HeatmapPoint.geom)
+        .where(HeatmapPoint.heatmap_id == latest.c.id)
+        .where(func.ST_DWithin(HeatmapPoint.geom, location, max_distance))
+        .order_by(HeatmapPoint.geom.distance_centroid(location))
+        .limit(1)
+        .lateral()
+    )
+    with session_scope() as session:
+        rows = (
+            session.query(latest.c.subcategory, latest.c.id, latest.c.kde_engine, nearest.c.weight,
+                          func.ST_X(nearest.c.geom), func.ST_Y(nearest.c.geom))
+            .select_from(latest)
+            .join(nearest, true())
+            .all()
+        )
+
+    return {subcategory: [weight, np.array([x, y]), heatmap_id, kde_engine]
+            for subcategory, heatmap_id, kde_engine, weight, x, y in rows}
+
+
+def suggest_best_subcategories(selected_location, district, server_side=False):
     """Suggest the best subcategories for the selected location."""
-    # Fetch all heatmaps from the database
-    heatmaps = fetch_all_heatmaps(district)
+    if server_side:
+        # Let PostGIS find the closest heatmap point of each subcategory
+        business_potential = evaluate_business_potential_server_side(selected_location, district.id)
+    else:
+        # Fetch the indexed heatmaps of the district (rebuilt only when new heatmaps were stored)
+        heatmap_index = load_heatmap_index(district.id)
 
-    # Evaluate business potential for each subcategory
-    business_potential = evaluate_business_potential(selected_location, heatmaps)
+        # Evaluate business potential for each subcategory
+        business_potential = heatmap_index.evaluate(selected_location)
 
     # Rank subcategories by business potential (higher density is better)
-    ranked_subcategories = sorted(business_potential.items(), key=lambda x: x[1], reverse=True)
+    ranked_subcategories = sorted(business_potential.items(), key=lambda x: x[1][0], reverse=True)
     return ranked_subcategories
 
 
+def score_locations(locations, district_id, top=None):
+    """
+    Rank the subcategories at many candidate locations at once.
+
+    locations is an N×2 array of (lat, lon). All of them are scored against the district's indexed
+    heat maps in one pass (see HeatmapIndex.evaluate_many). Returns a DataFrame with one row per
+    location and scored subcategory (location, lat, lon, rank, subcategory, density, heatmap_id),
+    sorted by location and rank; top keeps only the best subcategories of each location. Locations
+    with no heat map point within range have no rows.
+    """
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+    subcategories, densities, heatmap_ids = load_heatmap_index(district_id).evaluate_many(locations)
+
+    location_index, column = np.nonzero(~np.isnan(densities))
+    table = pd.DataFrame({
+        "location": location_index,
+        "lat": locations[location_index, 0],
+        "lon": locations[location_index, 1],
+        "subcategory": np.array(subcategories, dtype=object)[column],
+        "density": densities[location_index, column],
+        "heatmap_id": heatmap_ids[location_index, column],
+    })
+    table["rank"] = table.groupby("location")["density"].rank(method="first", ascending=False).astype(int)
+    if top is not None:
+        table = table[table["rank"] <= top]
+    table = table.sort_values(["location", "rank"], ignore_index=True)
+    return table[["location", "lat", "lon", "rank", "subcategory", "density", "heatmap_id"]]
+
+
+def read_candidate_locations(uploaded_file):
+    """N×2 (lat, lon) array from a CSV with lat/latitude and lon/lng/longitude columns."""
+    candidates = pd.read_csv(uploaded_file)
+    columns = {column.strip().lower(): column for column in candidates.columns}
+    lat_column = next((columns[name] for name in ("lat", "latitude") if name in columns), None)
+    lon_column = next((columns[name] for name in ("lon", "lng", "longitude") if name in columns), None)
+    if lat_column is None or lon_column is None:
+        raise ValueError("The CSV needs a lat (or latitude) and a lon (or lng/longitude) column.")
+    candidates = candidates[[lat_column, lon_column]].apply(pd.to_numeric, errors="coerce").dropna()
+    return candidates.to_numpy(dtype=float)
+
+
+def polygon_candidate_locations(polygon, spacing):
+    """Grid of candidate locations every spacing degrees inside a (lat, lon) polygon."""
+    grid_coords = build_grid(polygon.bounds, spacing)
+    return grid_coords[grid_mask(grid_coords, polygon, [])]
+
+
+def batch_scoring():
+    st.title("📋 Batch Scoring")
+    st.write("Rank the subcategories at many candidate locations at once, from a CSV file or a drawn area.")
+    st.divider()
+
+    col1, col2 = st.columns([0.5, 0.5])
+    with col1:
+        selected_district = select_district()
+    with col2:
+        top = st.number_input("Subcategories per location:", 1, 100, 3)
+
+    source = st.radio("Candidate locations:", ["Upload CSV", "Draw an area"], horizontal=True)
+    locations = None
+    if source == "Upload CSV":
+        uploaded_file = st.file_uploader("CSV with lat and lon columns", type="csv")
+        if uploaded_file is not None:
+            try:
+                locations = read_candidate_locations(uploaded_file)
+            except ValueError as e:
+                st.error(str(e))
+    else:
+        spacing = st.number_input("Candidate spacing(m):", 10, 5000, 100) / 100000
+        district_center = selected_district.shape.centroid
+        m = folium.Map(location=(district_center.x, district_center.y), zoom_start=13)
+        selected_district.add_to_map(m, fill_opacity=0.1)
+        folium.plugins.Draw(
+            draw_options={'polygon': True, 'rectangle': True, 'marker': False, 'circlemarker': False,
+                          'circle': False, 'polyline': False},
+            edit_options={'edit': False}
+        ).add_to(m)
+        output = st_folium(m, width=700, height=500, key='batch_scoring_map')
+        drawn_data = output.get('last_active_drawing') if output else None
+        if drawn_data and drawn_data['geometry']['type'] == 'Polygon':
+            coordinates = [(lat, lon) for lon, lat in drawn_data['geometry']['coordinates'][0]]
+            locations = polygon_candidate_locations(Polygon(coordinates), spacing)
+        else:
+            st.info("Draw a polygon or rectangle on the map to score the locations inside it.")
+
+    if locations is None:
+        return
+    st.write(f"{len(locations)} candidate locations.")
+    if len(locations) == 0:
+        return
+
+    if st.button("Score locations", type='primary'):
+        table = score_locations(locations, selected_district.id, top)
+        if table.empty:
+            st.warning("No heat map covers these locations.")
+            return
+        st.dataframe(table, use_container_width=True, hide_index=True)
+        st.download_button("Download results", table.to_csv(index=False).encode("utf-8"),
+                           file_name=f"scores_{selected_district.id}.csv", mime="text/csv")
+
+
 def display_suggestions():
     st.title("💼 Business Suggestion")
     st.write(
@@ -114,9 +241,8 @@ def display_suggestions():
         selected_district = select_district()
 
     district_group = folium.FeatureGroup(name="District").add_to(m)
-    district_polygon = Polygon(to_shape(selected_district.geom))
     folium.Polygon(
-        locations=[(lon, lat) for lon, lat in district_polygon.exterior.coords],
+        locations=selected_district.display_ring(),
         color="green",
         weight=1,
         fill=True,
@@ -161,13 +287,18 @@ def display_suggestions():
         f"Longitude {st.session_state['selected_location'][1]:.6f}"
     )
 
+    server_side = st.toggle("Evaluate in the database", help="Find the closest heat map points with PostGIS instead "
+                                                             "of loading every heat map into the app.")
+    heatmap_image = st.toggle("Show the heat map as an image", value=True,
+                              help="Draw the surface as one cached picture instead of sending every point to the map.")
+
     # Button to suggest subcategories
     if st.button("Suggest Best Subcategory"):
         # Ensure the location is passed as a NumPy array for processing
         selected_location_np = np.array(st.session_state["selected_location"])
 
         # Get ranked subcategories for the selected location
-        ranked_subcategories = suggest_best_subcategories(selected_location_np, selected_district)
+        ranked_subcategories = suggest_best_subcategories(selected_location_np, selected_district, server_side)
 
         # Display the top suggestions
         st.write("### Top Subcategory Suggestions:")
@@ -179,11 +310,11 @@ def display_suggestions():
             st.dataframe(
                 table,
                 column_config={
-                    "index_col": "",
-                    1: "Business",
-                    2: "Density",
-                    3: "Coordinates",
-                    4: "heatmap.id",
+                    "index": "Business",
+                    0: "Density",
+                    1: "Coordinates",
+                    2: "heatmap.id",
+                    3: "KDE engine",
                 },
                 use_container_width=True,
             )
@@ -200,19 +331,19 @@ def display_suggestions():
                     fill_color='blue',
                     popup="<b>" + loc[0] + "</b>"
                 ).add_to(locations_group)
-            session = db_handler()
-            heatmap = session.query(func.ST_AsGeoJSON(Heatmap.geom), Heatmap.weights).filter(
-                Heatmap.id == ranked_subcategories[0][1][2]).first()
-            session.close()
-            geom = json.loads(heatmap[0])
-            weights = heatmap[1]
-
             heatmap_group = folium.FeatureGroup(name='Heatmap').add_to(city_map)
-            heatmap_data = []
-            for coord, weight in zip(geom['coordinates'], weights):
-                heatmap_data.append([coord[0], coord[1], weight])
-
-            HeatMap(heatmap_data).add_to(heatmap_group)
+            if heatmap_image:
+                add_surface_overlay(heatmap_group, *load_surface_overlay(ranked_subcategories[0][1][2]))
+            else:
+                with session_scope() as session:
+                    heatmap = session.get(Heatmap, ranked_subcategories[0][1][2])
+                locations, weights = heatmap.surface_arrays()
+
+                heatmap_data = []
+                for coord, weight in zip(locations, weights):
+                    heatmap_data.append([coord[0], coord[1], weight])
+
+                HeatMap(heatmap_data).add_to(heatmap_group)
             folium.LayerControl().add_to(city_map)
             folium_static(city_map, width=700, height=500)
 
@@ -249,19 +380,16 @@ def generate_heatmaps():
 
         with col2:
             percentile = st.slider("Percentile:", 0, 100, 100, disabled=(not custom_parameters))
+            engine = st.selectbox("Density engine:", DENSITY_ENGINES, index=2,
+                                  help="exact: haversine KDE at every grid point, approximate: ball tree KDE with "
+                                       "automatic tolerances, binned: fast FFT approximation")
+        kde_params = select_kde_params(engine, disabled=(not custom_parameters))
 
     categories, slugs = fetch_categories()
     col1, col2 = st.columns([0.4, 0.6])
 
     with col1:
-        if st.button("Generate", type='primary'):
-            session = db_handler()
-            for category, sub_categories in categories.items():
-                for sub_category in sub_categories:
-                    highest_density_points = generate_heatmap(buffer_distance, percentile, category,
-                                                              sub_category, selected_district, session)
-            st.toast("All possible Heat maps generated successfully.", icon='✅')
-            session.close()
+        generate = st.button("Generate", type='primary')
     with col2:
         if st.button("Clear"):
             st.session_state.heatmap_generated = False
@@ -269,6 +397,22 @@ def generate_heatmaps():
             st.session_state.highest_density_points = None
             st.rerun()
 
+    if generate:
+        subcategories = [(category, sub_category)
+                         for category, sub_categories in categories.items() for sub_category in sub_categories]
+        progress_text = "Generating heat maps. Please wait."
+        sp_bar = st.progress(0, text=progress_text)
+
+        def update_progress(done, total, result):
+            sp_bar.progress(done / total, text=f"{done}/{total} - {result['subcategory']}: {result['status']}")
+
+        with session_scope() as session:
+            results = generate_heatmaps_batch(session, selected_district.id, subcategories, buffer_distance,
+                                              percentile, engine, progress=update_progress, kde_params=kde_params)
+        sp_bar.empty()
+        st.dataframe(pd.DataFrame(results), use_container_width=True)
+        st.toast("All possible Heat maps generated successfully.", icon='✅')
+
     print("_______________________________________________________________________________________")
 
 
@@ -1,16 +1,15 @@
-import requests
 import streamlit as st
 
+from http_cache import cached_get_json
+
 
 @st.cache_data(ttl=6000)
 def fetch_category_data(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    return {}
+    return cached_get_json(url, ttl=CATEGORY_CACHE_TTL)
 
 
 category_url = "https://search.raah.ir/v6/bundle-list/full/"
+CATEGORY_CACHE_TTL = 7 * 24 * 3600
 
 
 @st.cache_data()
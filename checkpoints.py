@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+
+from shapely import box, from_wkt
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = Path(os.environ.get("SCRAPE_CHECKPOINT_DIR", ".scrape_checkpoints"))
+
+
+def cell_key(cell):
+    """Identify a scrape cell by its grid box, stable across runs."""
+    return ",".join(f"{value:.7f}" for value in cell["box"].bounds)
+
+
+class ScrapeCheckpoint:
+    """
+    On-disk record of the cells of a district/subcategory scrape that are already done.
+
+    Completed cells are stored with the time they were scraped, so an interrupted job resumes where
+    it left off and a later re-scrape skips cells refreshed less than refresh_after seconds ago
+    (None skips every completed cell). Cells queued by adaptive splitting are stored too, so a
+    resumed job still visits the quadrants of a saturated cell. The time of the last reset is kept
+    so cached API responses from before it are not reused (see cache_ttl).
+    """
+
+    def __init__(self, district_id, slug, refresh_after=None, directory=CHECKPOINT_DIR, save_every=10):
+        slug = re.sub(r"[^\w-]", "_", slug)
+        self.path = Path(directory) / f"{district_id}_{slug}.json"
+        self.refresh_after = refresh_after
+        self.save_every = save_every
+        self.unsaved = 0
+        self.completed = {}
+        self.queued = {}
+        self.reset_at = None
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                self.completed = data.get("completed", {})
+                self.queued = data.get("queued", {})
+                self.reset_at = data.get("reset_at")
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reading scrape checkpoint {self.path}: {e}", exc_info=True)
+
+    def cache_ttl(self, ttl):
+        """
+        Maximum age of the cached responses this scrape may reuse: ttl, capped at the refresh window so
+        a cell due for refresh really hits the API, and at the time since the last reset.
+        """
+        if self.refresh_after is not None:
+            ttl = min(ttl, self.refresh_after)
+        if self.reset_at is not None:
+            ttl = min(ttl, max(0.0, time.time() - self.reset_at))
+        return ttl
+
+    def is_fresh(self, cell):
+        scraped_at = self.completed.get(cell_key(cell))
+        if scraped_at is None:
+            return False
+        return self.refresh_after is None or time.time() - scraped_at < self.refresh_after
+
+    def pending(self, cells):
+        """The cells still to scrape: the given ones that are not fresh plus unfinished split quadrants."""
+        cells = [cell for cell in cells if not self.is_fresh(cell)]
+        keys = {cell_key(cell) for cell in cells}
+        for key, queued in self.queued.items():
+            if key not in keys and key not in self.completed:
+                cells.append({"polygon": from_wkt(queued["polygon"]), "centroid": tuple(queued["centroid"]),
+                              "box": box(*queued["box"]), "meters": queued["meters"]})
+        return cells
+
+    def mark_done(self, cell, children=(), flush=None):
+        """
+        Record a scraped cell and the cells it was split into. Every save_every cells the checkpoint is
+        saved, after calling flush so the stored locations are never behind the checkpoint.
+        """
+        key = cell_key(cell)
+        self.completed[key] = time.time()
+        self.queued.pop(key, None)
+        for child in children:
+            self.queued[cell_key(child)] = {"polygon": child["polygon"].wkt, "centroid": list(child["centroid"]),
+                                            "box": list(child["box"].bounds), "meters": child["meters"]}
+            self.completed.pop(cell_key(child), None)
+        self.unsaved += 1
+        if self.unsaved >= self.save_every:
+            if flush is not None:
+                flush()
+            self.save()
+
+    def save(self):
+        """Write the checkpoint atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        temporary.write_text(json.dumps({"completed": self.completed, "queued": self.queued, "reset_at": self.reset_at}),
+                             encoding="utf-8")
+        os.replace(temporary, self.path)
+        self.unsaved = 0
+
+    def reset(self):
+        """Forget every scraped cell, so the next scrape fetches them all again from the API."""
+        self.completed = {}
+        self.queued = {}
+        self.reset_at = time.time()
+        self.save()
@@ -0,0 +1,204 @@
+"""
+Headless entry point for the long-running pipelines.
+
+Examples (run from the project root):
+    python cli.py scrape --district "منطقه 1" --subcategory رستوران
+    python cli.py heatmaps --district "منطقه 1" --engine binned
+    python cli.py heatmaps --district "منطقه 1" --subcategory رستوران --percentile 50
+    python cli.py heatmaps --district "منطقه 1" --engine exact --kde-algorithm ball_tree --leaf-size 100
+    python cli.py backfill-points
+    python cli.py retention --keep 1
+
+Progress and results are printed to stdout as one JSON object per line. Exit codes: 0 success,
+1 pipeline error, 2 invalid arguments, 3 nothing to do (unknown district/subcategory or no data).
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+
+from geoalchemy2.shape import to_shape
+from shapely import Polygon
+
+from async_scrape import scrape_cells_concurrently
+from batch import generate_heatmaps_batch
+from categories import fetch_categories
+from checkpoints import ScrapeCheckpoint
+from dbhandler import db_handler
+from http_cache import response_cache
+from density import DENSITY_ENGINES, TREE_ALGORITHMS
+from districts import District
+from heatmaps import Heatmap, HeatmapPoint
+from scrape import ADAPTIVE_START_METERS, adaptive_splitter, district_cells, scrape_cells
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_NO_DATA = 3
+
+logger = logging.getLogger(__name__)
+
+
+def emit(event, **fields):
+    """Write one structured progress record."""
+    print(json.dumps({"event": event, "time": round(time.time(), 3), **fields}, ensure_ascii=False), flush=True)
+
+
+def find_district(session, name):
+    district = session.query(District).filter(District.name == name).first()
+    if district is None:
+        emit("error", message=f"District '{name}' not found.")
+    return district
+
+
+def select_subcategories(requested):
+    """(category, subcategory, slug) triples for the requested subcategories, or all of them."""
+    categories, slugs = fetch_categories()
+    selected = [(category, sub_category, slugs[category][sub_category])
+                for category, sub_categories in categories.items() for sub_category in sub_categories
+                if not requested or sub_category in requested]
+    missing = set(requested or []) - {sub_category for _, sub_category, _ in selected}
+    if missing:
+        emit("error", message=f"Unknown subcategories: {', '.join(sorted(missing))}")
+        return None
+    return selected
+
+
+def run_scrape(args):
+    cache_before = response_cache.stats()
+    session = db_handler()
+    try:
+        district = find_district(session, args.district)
+        subcategories = select_subcategories(args.subcategory)
+        if district is None or not subcategories:
+            return EXIT_NO_DATA
+        coords = list(Polygon(to_shape(district.geom)).exterior.coords)
+        cells, large_polygon = district_cells(coords, ADAPTIVE_START_METERS if args.adaptive else 500)
+        split = adaptive_splitter(large_polygon) if args.adaptive else None
+        emit("start", pipeline="scrape", district=district.name, subcategories=len(subcategories), cells=len(cells),
+             adaptive=args.adaptive)
+        for category, sub_category, slug in subcategories:
+            checkpoint = ScrapeCheckpoint(district.id, slug, refresh_after=args.refresh_hours * 3600)
+            if args.reset:
+                checkpoint.reset()
+
+            def progress(done, total, search_results):
+                emit("progress", subcategory=sub_category, done=done, total=total, found=len(search_results))
+
+            if args.concurrency > 1:
+                search_results, stats = scrape_cells_concurrently(session, cells, slug, category, sub_category,
+                                                                  concurrency=args.concurrency, rate=args.rate,
+                                                                  progress=progress, split=split, checkpoint=checkpoint)
+            else:
+                search_results, stats = scrape_cells(session, cells, slug, category, sub_category, progress=progress,
+                                                     split=split, checkpoint=checkpoint)
+            emit("result", subcategory=sub_category, found=len(search_results), **stats)
+    finally:
+        session.close()
+    emit("done", pipeline="scrape", cache=response_cache.stats(since=cache_before))
+    return EXIT_OK
+
+
+def run_heatmaps(args):
+    session = db_handler()
+    try:
+        district = find_district(session, args.district)
+        subcategories = select_subcategories(args.subcategory)
+        if district is None or not subcategories:
+            return EXIT_NO_DATA
+        kde_params = {name: value for name, value in (("algorithm", args.kde_algorithm), ("leaf_size", args.leaf_size),
+                                                      ("atol", args.atol), ("rtol", args.rtol)) if value is not None}
+        emit("start", pipeline="heatmaps", district=district.name, subcategories=len(subcategories),
+             engine=args.engine, kde_params=kde_params)
+
+        def progress(done, total, result):
+            emit("progress", done=done, total=total, **result)
+
+        results = generate_heatmaps_batch(session, district.id,
+                                          [(category, sub_category) for category, sub_category, _ in subcategories],
+                                          args.buffer_distance / 100000, args.percentile, args.engine,
+                                          workers=args.workers, progress=progress, kde_params=kde_params or None)
+    finally:
+        session.close()
+    generated = sum(result["status"] == "ok" for result in results)
+    emit("done", pipeline="heatmaps", generated=generated, total=len(results))
+    return EXIT_OK if generated else EXIT_NO_DATA
+
+
+def run_backfill_points(args):
+    session = db_handler()
+    try:
+        added = HeatmapPoint.backfill(session)
+    finally:
+        session.close()
+    emit("done", pipeline="backfill-points", heatmaps=added)
+    return EXIT_OK
+
+
+def run_retention(args):
+    session = db_handler()
+    try:
+        deleted, compacted = Heatmap.apply_retention(session, args.keep)
+    finally:
+        session.close()
+    emit("done", pipeline="retention", deleted=deleted, compacted_points=compacted)
+    return EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run scraping and heat map pipelines without the Streamlit UI.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scrape = subparsers.add_parser("scrape", help="Scrape existing locations of a district.")
+    scrape.add_argument("--district", required=True, help="District name as stored in the database.")
+    scrape.add_argument("--subcategory", action="append",
+                        help="Subcategory to scrape (repeatable). Defaults to every subcategory.")
+    scrape.add_argument("--concurrency", type=int, default=8, help="Concurrent requests (1 scrapes sequentially).")
+    scrape.add_argument("--rate", type=float, default=5.0, help="Maximum requests per second.")
+    scrape.add_argument("--adaptive", action="store_true",
+                        help="Start from coarse cells and split only the ones with truncated results.")
+    scrape.add_argument("--refresh-hours", type=float, default=24,
+                        help="Skip cells scraped less than this many hours ago (interrupted jobs resume).")
+    scrape.add_argument("--reset", action="store_true", help="Forget previous progress and scrape every cell.")
+    scrape.set_defaults(func=run_scrape)
+
+    heatmaps = subparsers.add_parser("heatmaps", help="Generate heat maps of a district.")
+    heatmaps.add_argument("--district", required=True, help="District name as stored in the database.")
+    heatmaps.add_argument("--subcategory", action="append",
+                          help="Subcategory to generate (repeatable). Defaults to every subcategory.")
+    heatmaps.add_argument("--buffer-distance", type=float, default=500, help="Buffer distance in meters.")
+    heatmaps.add_argument("--percentile", type=float, default=100)
+    heatmaps.add_argument("--engine", choices=DENSITY_ENGINES, default="binned", help="Density engine.")
+    heatmaps.add_argument("--kde-algorithm", choices=TREE_ALGORITHMS, default=None,
+                          help="Tree of the exact and approximate engines.")
+    heatmaps.add_argument("--leaf-size", type=int, default=None, help="Leaf size of the KDE tree.")
+    heatmaps.add_argument("--atol", type=float, default=None, help="Absolute tolerance of the KDE tree.")
+    heatmaps.add_argument("--rtol", type=float, default=None,
+                          help="Relative tolerance of the KDE tree (unset: the engine's own setting).")
+    heatmaps.add_argument("--workers", type=int, default=None, help="Worker processes (defaults to CPU count).")
+    heatmaps.set_defaults(func=run_heatmaps)
+
+    backfill = subparsers.add_parser("backfill-points",
+                                     help="Index the points of heat maps stored before server-side suggestions.")
+    backfill.set_defaults(func=run_backfill_points)
+
+    retention = subparsers.add_parser("retention", help="Delete old heat map generations and compact superseded ones.")
+    retention.add_argument("--keep", type=int, default=1,
+                           help="Superseded generations to keep per district/percentile/subcategory.")
+    retention.set_defaults(func=run_retention)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except Exception as e:
+        logger.error(f"Error running {args.command}: {e}", exc_info=True)
+        emit("error", message=str(e))
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+from sqlalchemy import Column, Integer, String, func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+import logging
+
+from dbhandler import Base, session_scope
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Degrees around a district whose businesses feed its heat maps
+DISTRICT_MARGIN = 0.01
+
+# Subcategory of the versions bumped by changes that affect every subcategory of a district (banned zones)
+ALL_SUBCATEGORIES = ""
+
+
+class DataVersion(Base):
+    """
+    Counter of the changes to the inputs of a (district, subcategory) heat map. The pipeline caches are
+    keyed by it, so they are recomputed exactly when businesses are ingested or banned zones edited.
+    """
+    __tablename__ = "data_version"
+
+    district_id = Column(Integer, primary_key=True)
+    subcategory = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, session, pairs):
+        """
+        Increment the version of every (district_id, subcategory) row of the pairs select, creating missing
+        rows. Runs in the caller's transaction, so the bump commits with the change it records.
+        """
+        pairs = pairs.add_columns(literal(1)).distinct()
+        statement = insert(cls).from_select(["district_id", "subcategory", "version"], pairs)
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.district_id, cls.subcategory],
+            set_={"version": cls.version + 1},
+        )
+        return session.execute(statement).rowcount
+
+    @classmethod
+    def bump_for_locations(cls, session, location_ids):
+        """Bump the subcategories of the given new locations in every district within DISTRICT_MARGIN of them."""
+        from districts import District
+        from locations import Location
+
+        if not location_ids:
+            return 0
+        pairs = (
+            select(District.id, Location.subcategory)
+            .join(Location, func.ST_DWithin(Location.geom, District.geom, DISTRICT_MARGIN))
+            .where(Location.id.in_(location_ids))
+            .where(Location.subcategory.is_not(None))
+        )
+        return cls.bump(session, pairs)
+
+    @classmethod
+    def bump_for_banned_zone(cls, session, geom=None):
+        """Bump every subcategory of the districts crossing a banned zone (of every district if geom is None)."""
+        from districts import District
+
+        pairs = select(District.id, literal(ALL_SUBCATEGORIES))
+        if isinstance(geom, str):  # EWKT of a polygon that is not stored yet
+            geom = func.ST_GeomFromEWKT(geom)
+        if geom is not None:
+            pairs = pairs.where(func.ST_Intersects(District.geom, geom))
+        return cls.bump(session, pairs)
+
+
+def data_version(district_id, subcategory):
+    """
+    (subcategory version, banned zones version) of a district: the cache key of its heat map inputs.
+    Deliberately not cached itself: it is a primary key lookup, and it must see other processes' changes.
+    """
+    with session_scope() as session:
+        versions = dict(session.execute(
+            select(DataVersion.subcategory, DataVersion.version)
+            .where(DataVersion.district_id == district_id)
+            .where(DataVersion.subcategory.in_([subcategory, ALL_SUBCATEGORIES]))
+        ).all())
+    return versions.get(subcategory, 0), versions.get(ALL_SUBCATEGORIES, 0)
@@ -0,0 +1,188 @@
+import time
+
+import numpy as np
+import streamlit as st
+
+from spatial import build_grid, grid_mask
+
+DENSITY_ENGINES = ("exact", "approximate", "binned")
+# Trees that support the haversine metric (sklearn's kd_tree does not); "auto" picks the ball tree
+TREE_ALGORITHMS = ("auto", "ball_tree")
+# Below this relative tolerance the ball tree prunes next to nothing, so the approximate engine stays exact
+MIN_USEFUL_RTOL = 1e-4
+
+
+def silverman_bandwidth(n_samples, n_features=2):
+    """Same rule sklearn's KernelDensity uses for bandwidth='silverman' (in radians here)."""
+    return (n_samples * (n_features + 2) / 4) ** (-1 / (n_features + 4))
+
+
+def auto_tree_params(n_businesses, n_cells, bandwidth, extent, target_error=1e-3):
+    """
+    Pick ball tree settings for the approximate engine from the problem size.
+
+    leaf_size grows with the number of businesses, and small problems (businesses x cells under 5e6)
+    stay exact. Otherwise rtol is chosen so that the error of the min-max normalized surface stays
+    around target_error: the surface only varies by roughly (extent / bandwidth)^2 / 2 relative to its
+    level, and a relative tolerance on the raw density is magnified by the inverse of that contrast once
+    normalized. extent and bandwidth are in radians. With the silverman bandwidth over a district the
+    contrast is tiny and the allowed rtol falls under MIN_USEFUL_RTOL, so the settings stay exact.
+    """
+    params = {"algorithm": "ball_tree", "leaf_size": 40 if n_businesses < 10000 else 100, "atol": 0, "rtol": 0}
+    if n_businesses * n_cells > 5e6:
+        contrast = min(1.0, (extent / bandwidth) ** 2 / 2)
+        if target_error * contrast >= MIN_USEFUL_RTOL:
+            params["rtol"] = target_error * contrast
+    return params
+
+
+def exact_density(coords, grid_coords, bandwidth='silverman', algorithm='auto', leaf_size=40, atol=0, rtol=0):
+    """
+    Evaluate a gaussian KDE with the haversine metric at every grid point (O(grid x businesses)).
+
+    With the default zero tolerances the result is exact; atol/rtol let sklearn's tree prune whole
+    nodes once the requested absolute/relative accuracy is reached.
+    """
+    from sklearn.neighbors import KernelDensity  # Imported on first use: sklearn is slow to import
+
+    kde = KernelDensity(kernel="gaussian", bandwidth=bandwidth, metric='haversine',  # Bandwidth controls smoothness
+                        algorithm=algorithm, leaf_size=leaf_size, atol=atol, rtol=rtol)
+    kde.fit(np.radians(coords))  # Convert to radians for haversine metric
+    return np.exp(kde.score_samples(np.radians(grid_coords)))
+
+
+def binned_density(coords, grid_coords, grid_size=0.001, bandwidth='silverman'):
+    """
+    Approximate the haversine gaussian KDE by linear binning plus FFT convolution.
+
+    The businesses are linearly binned onto the regular lattice the grid points lie on (extended to
+    cover every business), projected with a local equirectangular projection around the lattice's
+    central latitude phi0, and convolved with the gaussian kernel sampled on that lattice. Cost is
+    O(lattice * log(lattice)) regardless of the number of businesses.
+
+    Error bound versus exact_density, with h the bandwidth and delta the cell size (both in radians):
+      * projection: pair distances are off by a relative factor of at most tan|phi0| * dphi, where
+        dphi is the largest latitude offset of the lattice from phi0 (~0.13% for a 0.2 degree tall
+        district at Tehran's latitude). The kernel exponent, and so the relative density, moves by at
+        most that factor times (D / h)^2, with D the largest business-to-cell distance.
+      * binning: spreading a business over its four neighbouring cells changes each kernel
+        contribution by at most (delta / h)^2 / 4 of the kernel peak.
+    """
+    from scipy.signal import fftconvolve
+
+    if bandwidth == 'silverman':
+        bandwidth = silverman_bandwidth(*coords.shape)
+
+    origin = grid_coords.min(axis=0)
+    grid_index = np.rint((grid_coords - origin) / grid_size).astype(int)
+
+    # Lattice covering both the grid and every business
+    position = (coords - origin) / grid_size
+    low = np.minimum(np.floor(position.min(axis=0)).astype(int), 0)
+    high = np.maximum(np.floor(position.max(axis=0)).astype(int) + 1, grid_index.max(axis=0))
+    shape = tuple(high - low + 1)
+
+    # Linear binning: each business is split between the four surrounding cells
+    base = np.floor(position).astype(int)
+    fraction = position - base
+    base -= low
+    counts = np.zeros(shape)
+    for d_lat in (0, 1):
+        for d_lon in (0, 1):
+            w_lat = fraction[:, 0] if d_lat else 1 - fraction[:, 0]
+            w_lon = fraction[:, 1] if d_lon else 1 - fraction[:, 1]
+            np.add.at(counts, (base[:, 0] + d_lat, base[:, 1] + d_lon), w_lat * w_lon)
+
+    # Gaussian kernel over every lattice offset, on a local equirectangular projection
+    phi0 = np.radians(origin[0] + (low[0] + high[0]) / 2 * grid_size)
+    step = np.radians(grid_size)
+    offsets_lat = np.arange(-(shape[0] - 1), shape[0]) * step
+    offsets_lon = np.arange(-(shape[1] - 1), shape[1]) * step * np.cos(phi0)
+    kernel = np.exp(-0.5 * (offsets_lat[:, None] ** 2 + offsets_lon[None, :] ** 2) / bandwidth ** 2)
+    kernel /= 2 * np.pi * bandwidth ** 2 * len(coords)
+
+    surface = fftconvolve(counts, kernel, mode='same')
+    density = surface[grid_index[:, 0] - low[0], grid_index[:, 1] - low[1]]
+    # FFT round-off can leave tiny negative values far from any business
+    return np.clip(density, 0, None)
+
+
+def estimate_density(coords, grid_coords, engine="exact", grid_size=0.001, kde_params=None):
+    """
+    Evaluate the business density at the grid points with the selected engine.
+
+    Returns (density, info) where info records the engine, its effective settings and the run time,
+    so the accuracy/speed trade-off can be stored with the surface. kde_params overrides the tree
+    settings (algorithm, leaf_size, atol, rtol) of the exact and approximate engines.
+    """
+    start = time.perf_counter()
+    bandwidth = silverman_bandwidth(*coords.shape)
+    info = {"engine": engine, "bandwidth": bandwidth, "grid_size": grid_size}
+    if engine == "exact":
+        params = {"algorithm": "auto", "leaf_size": 40, "atol": 0, "rtol": 0}
+    elif engine == "approximate":
+        extent = np.radians(np.ptp(np.vstack([coords, grid_coords]), axis=0).max())
+        params = auto_tree_params(len(coords), len(grid_coords), bandwidth, extent)
+    elif engine == "binned":
+        params = {}
+    else:
+        raise ValueError(f"Unknown density engine '{engine}', expected one of {DENSITY_ENGINES}.")
+
+    if engine == "binned":
+        density = binned_density(coords, grid_coords, grid_size, bandwidth)
+    else:
+        params.update(kde_params or {})
+        density = exact_density(coords, grid_coords, bandwidth, **params)
+    info.update(params)
+    info["seconds"] = time.perf_counter() - start
+    return density, info
+
+
+def district_density(coords, district_polygon, banned_polys, engine="exact", grid_size=0.001, kde_params=None):
+    """
+    Normalized business density over the district grid, skipping banned zones.
+
+    Returns (density, valid_grid_coords, info), or (None, None, None) when no grid point survives the
+    masks. See estimate_density for info and kde_params.
+    """
+    # Create a grid of latitude and longitude points
+    grid_coords = build_grid(district_polygon.bounds, grid_size)
+
+    # Keep points inside the district and outside every banned zone
+    valid_grid_coords = grid_coords[grid_mask(grid_coords, district_polygon, banned_polys)]
+
+    # Handle empty grid case
+    if len(valid_grid_coords) == 0:
+        return None, None, None
+    # Evaluate density at each grid point
+    density, info = estimate_density(coords, valid_grid_coords, engine, grid_size, kde_params)
+
+    # Normalize density for better scaling
+    density = (density - density.min()) / (density.max() - density.min())
+
+    return density, valid_grid_coords, info
+
+
+def select_kde_params(engine, disabled=False):
+    """
+    Tree settings widgets of the exact and approximate engines. Returns the kde_params to pass on, or
+    None to keep the engine's own settings (always for the binned engine, which has no tree).
+    """
+    if engine == "binned":
+        return None
+    with st.expander("KDE tree settings"):
+        custom = st.toggle("Custom tree settings", disabled=disabled,
+                           help="Off: the exact engine runs with zero tolerances and the approximate engine picks "
+                                "its settings from the number of businesses and grid cells.")
+        locked = disabled or not custom
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            algorithm = st.selectbox("Tree:", TREE_ALGORITHMS, disabled=locked)
+            atol = st.number_input("Absolute tolerance:", 0.0, value=0.0, format="%g", disabled=locked)
+        with col2:
+            leaf_size = st.number_input("Leaf size:", 1, 10000, 40, disabled=locked)
+            rtol = st.number_input("Relative tolerance:", 0.0, 1.0, 0.0, format="%g", disabled=locked,
+                                   help="The normalized surface is nearly flat, so even 1e-6 can reorder it.")
+    if not custom:
+        return None
+    return {"algorithm": algorithm, "leaf_size": int(leaf_size), "atol": atol, "rtol": rtol}
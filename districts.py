@@ -1,23 +1,27 @@
 import time
 import requests
+import shapely
 import streamlit as st
 from geoalchemy2.functions import ST_Equals
 from geoalchemy2.shape import to_shape
-from sqlalchemy import Column, Integer, String, Numeric, and_
+from sqlalchemy import Column, Integer, String, Numeric, JSON, and_
 from geoalchemy2 import Geometry
-from sqlalchemy.orm import relationship
 from shapely.geometry import Polygon, Point, box, MultiPolygon
 import folium
 from streamlit_folium import st_folium
 import logging
 
-from dbhandler import Base, engine, db_handler
+from dbhandler import Base, db_handler, session_scope
+from data_versions import DataVersion
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 url = 'https://raw.githubusercontent.com/rferdosi/tehran-districts/main/districts.json'
 
+# Display-only simplification tolerances in degrees: ~50 m for city-wide overviews, ~10 m for one district
+DISPLAY_TOLERANCES = {"city": 0.0005, "district": 0.0001}
+
 colors = [
     "red", "blue", "green", "yellow", "cyan", "purple", "pink", "DodgerBlue",
     "brown", "black", "maroon", "magenta", "lime", "teal", "navy", "olive",
@@ -31,6 +35,61 @@ class PolygonEntity(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String)
     geom = Column(Geometry("POLYGON", srid=4326), nullable=False, unique=True)
+    display_geoms = Column(JSON, nullable=True)  # Simplified exterior ring per DISPLAY_TOLERANCES tier, for maps
+
+    _shape = None  # Memoized decoded geometry, see shape
+    _display_rings = None  # Rings computed for rows stored before display_geoms existed
+
+    @property
+    def shape(self):
+        """The geometry as a prepared shapely Polygon, decoded once per instance."""
+        if self._shape is None:
+            if isinstance(self.geom, str):  # New objects hold EWKT until they are stored
+                shape = Polygon(shapely.from_wkt(self.geom.split(";", 1)[-1]))
+            else:
+                shape = Polygon(to_shape(self.geom))
+            shapely.prepare(shape)
+            self._shape = shape
+        return self._shape
+
+    @staticmethod
+    def simplified_rings(polygon):
+        """Topology-preserving simplified exterior ring of the polygon for every display tier."""
+        rings = {}
+        for tier, tolerance in DISPLAY_TOLERANCES.items():
+            simplified = shapely.simplify(polygon, tolerance, preserve_topology=True)
+            rings[tier] = [[round(lat, 6), round(lon, 6)] for lat, lon in simplified.exterior.coords]
+        return rings
+
+    def display_ring(self, tier="district"):
+        """
+        (lat, lon) exterior ring to draw at the given zoom tier. Only for display: analysis uses shape,
+        the exact geometry.
+        """
+        if self.display_geoms and tier in self.display_geoms:
+            return self.display_geoms[tier]
+        if self._display_rings is None:
+            self._display_rings = self.simplified_rings(self.shape)
+        return self._display_rings[tier]
+
+    @classmethod
+    def backfill_display_geoms(cls, session):
+        """Store the display rings of the rows saved before display_geoms existed. Returns how many."""
+        rows = session.query(cls).filter(cls.display_geoms.is_(None)).all()
+        for row in rows:
+            row.display_geoms = cls.simplified_rings(row.shape)
+        session.commit()
+        if rows:
+            invalidate_district_caches()
+        return len(rows)
+
+    @classmethod
+    def record_change(cls, session, geom=None):
+        """Called before committing an added polygon (or every deletion, with geom None); see BannedDistrict."""
+
+    @property
+    def bounds(self):
+        return self.shape.bounds
 
     def add_to_db(self, session):
         """Common method for both classes"""
@@ -46,17 +105,19 @@ class PolygonEntity(Base):
             return
 
         try:
+            self.display_geoms = self.simplified_rings(self.shape)
             session.add(self)
+            self.record_change(session, self.geom)
             session.commit()
+            invalidate_district_caches()
             logger.info(f"{self.__class__.__name__} '{self.name}' added successfully!")
         except Exception as e:
             session.rollback()
             # logger.error(f"Error adding {self.__class__.__name__}: {e}", exc_info=True)
 
-    def add_to_map(self, map, color='green', fill_opacity=0.3):
-        geom = to_shape(self.geom)
+    def add_to_map(self, map, color='green', fill_opacity=0.3, tier="district"):
         folium.Polygon(
-            locations=[(lat, lon) for lat, lon in geom.exterior.coords],
+            locations=self.display_ring(tier),
             color=color,
             fill=True,
             fill_opacity=fill_opacity,
@@ -71,7 +132,9 @@ class PolygonEntity(Base):
         try:
             # Delete all rows in the district table
             session.query(cls).delete()
+            cls.record_change(session)
             session.commit()
+            invalidate_district_caches()
             logger.info("All districts deleted successfully!")
         except Exception as e:
             session.rollback()
@@ -80,8 +143,7 @@ class PolygonEntity(Base):
 
 class District(PolygonEntity):
     __tablename__ = "district"
-
-    heatmap = relationship("Heatmap")
+    # District.heatmap is created by the backref on Heatmap.district, so districts don't depend on heatmaps
 
 
 class BannedDistrict(PolygonEntity):
@@ -89,9 +151,53 @@ class BannedDistrict(PolygonEntity):
 
     reason = Column(String, nullable=True)
 
+    @classmethod
+    def record_change(cls, session, geom=None):
+        # Banned zones are an input of the heat maps of every district they cross
+        DataVersion.bump_for_banned_zone(session, geom)
+
 
-# Create tables if they don't exist
-Base.metadata.create_all(engine)
+@st.cache_data(ttl=3600)
+def district_catalog():
+    """(id, name) of every district, without loading their geometries."""
+    with session_scope() as session:
+        return [(district_id, name) for district_id, name in
+                session.query(District.id, District.name).order_by(District.id)]
+
+
+@st.cache_resource(max_entries=64)
+def load_district(district_id):
+    """
+    One district with its geometry, shared by every session of the app (read-only: it is detached from
+    the database session, and its decoded shape is memoized on it).
+    """
+    with session_scope() as session:
+        return session.get(District, district_id)
+
+
+@st.cache_resource
+def load_districts():
+    """Every district with its geometry, for the maps that draw all of them."""
+    with session_scope() as session:
+        return session.query(District).order_by(District.id).all()
+
+
+@st.cache_resource(ttl=600)
+def load_banned_districts():
+    """
+    Every banned zone, for the admin map. Expires so zones added by other processes show up; the heat map
+    pages draw the zones fetched with their data version instead.
+    """
+    with session_scope() as session:
+        return session.query(BannedDistrict).order_by(BannedDistrict.id).all()
+
+
+def invalidate_district_caches():
+    """Drop the cached districts and banned zones after they change in the database."""
+    district_catalog.clear()
+    load_district.clear()
+    load_districts.clear()
+    load_banned_districts.clear()
 
 
 @st.cache_data(ttl=600)
@@ -118,14 +224,14 @@ def extract_districts(geojson_data):
 
 
 def select_district():
-    session = db_handler()
-    districts = session.query(District).all()
+    # Only ids and names are needed for the selectbox; the selected district's geometry is loaded on its own
+    catalog = district_catalog()
+    names = [name for _, name in catalog]
 
-    selected_district = st.selectbox("Choose a district:", [district.name for district in districts])
+    selected_district = st.selectbox("Choose a district:", names)
     # st.write(f"Selected district: {selected_district}")
-    selected_district = [d for d in districts
-                         if d.name == selected_district][0]
-    return selected_district
+    district_id = catalog[names.index(selected_district)][0]
+    return load_district(district_id)
 
 
 def extract_tehran_districts():
@@ -137,15 +243,13 @@ def extract_tehran_districts():
     map_center = (35.71, 51.36)
     m = folium.Map(location=map_center, zoom_start=11)
     session = db_handler()
-    districts = session.query(District).all()
+    districts = load_districts()
     for i, district in enumerate(districts):
         if i > 18:
             i -= 18
 
-        p = to_shape(district.geom)
-        p = Polygon(p)
         folium.Polygon(
-            locations=[(lon, lat) for lon, lat in p.exterior.coords],
+            locations=district.display_ring("city"),
             color=colors[i],
             weight=1,
             fill=True,
@@ -175,7 +279,7 @@ def extract_tehran_districts():
         table = {}
         for district in districts:
             name = district.name
-            table[name] = Polygon(to_shape(district.geom)).exterior.coords
+            table[name] = district.shape.exterior.coords
         districts = table
     st.table(districts)
     session.close()
@@ -185,13 +289,10 @@ def adding_polygon_base():
     # Create a Folium map centered on Tehran with drawing tools
     map_center = (35.71, 51.36)
     m = folium.Map(location=map_center, zoom_start=11)
-    session = db_handler()
-    districts = session.query(District).all()
-    for district in districts:
-        district.add_to_map(m, fill_opacity=0.1)
-    banned_districts = session.query(BannedDistrict).all()
-    for banned_district in banned_districts:
-        banned_district.add_to_map(m, 'red', 0.15)
+    for district in load_districts():
+        district.add_to_map(m, fill_opacity=0.1, tier="city")
+    for banned_district in load_banned_districts():
+        banned_district.add_to_map(m, 'red', 0.15, tier="city")
     draw = folium.plugins.Draw(
         draw_options={
             'polygon': True,
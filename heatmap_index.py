@@ -0,0 +1,73 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# A heat map only scores a location if one of its points is this close (in degrees)
+MAX_SUGGESTION_DISTANCE = 0.0007
+
+
+class HeatmapIndex:
+    """
+    In-memory index of a district's heat maps: one KD-tree over each heat map's points, with its
+    weights, so scoring a location is one O(log n) query per heat map instead of decoding and
+    scanning every surface.
+    """
+
+    def __init__(self, heatmaps):
+        self.entries = []
+        for heatmap in heatmaps:
+            points, weights = heatmap.surface_arrays()
+            self.entries.append({
+                "id": heatmap.id,
+                "subcategory": heatmap.subcategory,
+                "kde_engine": heatmap.kde_engine,
+                "points": points,
+                "weights": weights,
+                "tree": cKDTree(points),
+            })
+
+    def __len__(self):
+        return len(self.entries)
+
+    def evaluate(self, selected_location, max_distance=MAX_SUGGESTION_DISTANCE):
+        """
+        Business potential of each subcategory at the location, in the format of
+        business_suggestion.evaluate_business_potential: {subcategory: [density, point, heatmap id, engine]}.
+        """
+        results = {}
+        bound = np.nextafter(max_distance, np.inf)  # the tree excludes points exactly at the bound
+        for entry in self.entries:
+            distance, closest_point_index = entry["tree"].query(selected_location, k=1, distance_upper_bound=bound)
+            if not np.isfinite(distance):
+                continue
+            closest_point_density = entry["weights"][closest_point_index]
+            subcategory = entry["subcategory"]
+            if subcategory not in results or results[subcategory][0] < closest_point_density:
+                results[subcategory] = [closest_point_density, entry["points"][closest_point_index], entry["id"],
+                                        entry["kde_engine"]]
+        return results
+
+    def evaluate_many(self, locations, max_distance=MAX_SUGGESTION_DISTANCE):
+        """
+        Vectorized evaluate for an N×2 array of locations: one bulk KD-tree query per heat map.
+
+        Returns (subcategories, densities, heatmap_ids). densities is an N×S array with, for each location
+        and subcategory, the weight of the closest heat map point within max_distance (NaN when there is
+        none); heatmap_ids holds the id of the heat map each weight comes from (-1 when there is none).
+        """
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+        subcategories = list(dict.fromkeys(entry["subcategory"] for entry in self.entries))
+        columns = {subcategory: column for column, subcategory in enumerate(subcategories)}
+        densities = np.full((len(locations), len(subcategories)), np.nan)
+        heatmap_ids = np.full(densities.shape, -1, dtype=np.int64)
+        bound = np.nextafter(max_distance, np.inf)
+        for entry in self.entries:
+            distance, closest_point_index = entry["tree"].query(locations, k=1, distance_upper_bound=bound)
+            found = np.isfinite(distance)
+            weights = np.full(len(locations), np.nan)
+            weights[found] = entry["weights"][closest_point_index[found]]
+            column = columns[entry["subcategory"]]
+            # Like evaluate, a later heat map of the same subcategory only wins with a strictly higher density
+            better = found & ~(densities[:, column] >= weights)
+            densities[better, column] = weights[better]
+            heatmap_ids[better, column] = entry["id"]
+        return subcategories, densities, heatmap_ids
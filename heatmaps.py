@@ -1,59 +1,200 @@
 import logging
-import time
+import os
 
-import branca
-from sklearn.model_selection import GridSearchCV
-
-from districts import District, select_district, BannedDistrict
-from dbhandler import Base, engine
-from dbhandler import db_handler
-import folium
+from districts import District
+from dbhandler import Base, session_scope
 import numpy as np
+import shapely
 import streamlit as st
-from folium.plugins import HeatMap
 from geoalchemy2 import Geometry
 from geoalchemy2.shape import to_shape
-from scipy.spatial.distance import cdist  # For filtering based on buffer distance
-from shapely import Point, Polygon, MultiPoint
-from sklearn.neighbors import KernelDensity
-from sqlalchemy import Column, Integer, String, ForeignKey, func, ARRAY, Float
+from shapely import MultiPoint
+from sqlalchemy import Column, Integer, String, ForeignKey, func, ARRAY, Boolean, Float, Index, JSON, LargeBinary, exists, \
+    insert, text
 from sqlalchemy.orm import relationship
-from categories import fetch_categories, select_category
-from locations import Location
-from sklearn.cluster import DBSCAN
+from raster import encode_surface, decode_surface, surface_cell_size
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Storage format of new heat map surfaces: "raster" (compact surface column) or "multipoint" (geom + weights)
+HEATMAP_STORAGE = os.environ.get("HEATMAP_STORAGE", "raster")
+
 
 class Heatmap(Base):
     __tablename__ = 'heatmap'
 
     id = Column(Integer, primary_key=True)
-    geom = Column(Geometry('MULTIPOINT', srid=4326), nullable=False)  # Store all points as MULTIPOINT
-    weights = Column(ARRAY(Float), nullable=False)  # Store weights as an array of floats (density values)
+    geom = Column(Geometry('MULTIPOINT', srid=4326), nullable=True)  # Store all points as MULTIPOINT
+    weights = Column(ARRAY(Float), nullable=True)  # Store weights as an array of floats (density values)
+    surface = Column(LargeBinary, nullable=True)  # Points and weights as a compressed grid raster (raster.py)
     district_id = Column(Integer, ForeignKey('district.id'))  # Foreign key to District table
-    district = relationship(District.__name__, back_populates='heatmap')  # Relationship to District
+    district = relationship(District, backref='heatmap')  # Relationship to District
     category = Column(String(255), nullable=True)  # Category field
     subcategory = Column(String(255), nullable=False)  # Subcategory field
     buffer_distance = Column(Float, nullable=True)
     percentile = Column(Float, nullable=True)
+    kde_engine = Column(String(32), nullable=True)  # Density engine the surface was computed with
+    kde_params = Column(JSON, nullable=True)  # Bandwidth and tree tolerances used by the engine
+    kde_seconds = Column(Float, nullable=True)  # Time spent evaluating the density
+    is_current = Column(Boolean, nullable=True)  # Newest heat map of its district/percentile/subcategory
+
+    __table_args__ = (
+        # At most one current heat map per district/percentile/subcategory, and a direct lookup of it
+        Index('ix_heatmap_current', 'district_id', 'percentile', 'subcategory', unique=True,
+              postgresql_where=is_current.is_(True)),
+    )
 
     def add_to_db(self, session):
-        """Adds the current heat map object to the database."""
+        """Adds the current heat map object and its exploded points to the database, in one transaction."""
         try:
+            self.supersede(session)
             session.add(self)
+            session.flush()
+            HeatmapPoint.explode(session, [self.id])
             session.commit()
-            print(f"HeatMap '{self.id}' added successfully!")
             logger.info(f"HeatMap '{self.id}' added successfully!")
         except Exception as e:
-            print(f"Error adding HeatMap: {e}")
             logger.error(f"Error adding HeatMap: {e}", exc_info=True)
             session.rollback()
 
+    def supersede(self, session):
+        """Make this heat map the current one of its district/percentile/subcategory (applied on commit)."""
+        district_id = self.district_id if self.district_id is not None else self.district.id
+        session.query(Heatmap).filter(
+            Heatmap.district_id == district_id,
+            Heatmap.percentile == self.percentile,
+            Heatmap.subcategory == self.subcategory,
+            Heatmap.is_current.is_(True),
+        ).update({Heatmap.is_current: False}, synchronize_session=False)
+        self.is_current = True
+
+    @classmethod
+    def refresh_current(cls, session):
+        """Flag the newest heat map of every district/percentile/subcategory as current and the rest as not."""
+        newest = session.query(func.max(cls.id)).group_by(cls.district_id, cls.percentile, cls.subcategory)
+        session.query(cls).update({cls.is_current: cls.id.in_(newest.scalar_subquery())}, synchronize_session=False)
+        session.commit()
+
+    @classmethod
+    def apply_retention(cls, session, keep=1):
+        """
+        Compact the history of superseded heat maps: for every district/percentile/subcategory the `keep`
+        newest superseded generations are kept without their heatmap_point rows (only current heat maps
+        are used for suggestions) and older generations are deleted.
+
+        Returns (deleted, compacted) heat map counts.
+        """
+        generation = func.row_number().over(
+            partition_by=(cls.district_id, cls.percentile, cls.subcategory), order_by=cls.id.desc()
+        ).label('generation')
+        superseded = session.query(cls.id, generation).filter(cls.is_current.is_(False)).subquery()
+        expired = session.query(superseded.c.id).filter(superseded.c.generation > keep)
+        try:
+            deleted = session.query(cls).filter(cls.id.in_(expired.scalar_subquery())).delete(
+                synchronize_session=False)
+            compacted = session.query(HeatmapPoint).filter(HeatmapPoint.heatmap_id.in_(
+                session.query(cls.id).filter(cls.is_current.is_(False)).scalar_subquery()
+            )).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error applying HeatMap retention: {e}", exc_info=True)
+            raise
+        logger.info(f"HeatMap retention: {deleted} deleted, {compacted} points of superseded heat maps removed.")
+        return deleted, compacted
+
+    def set_surface(self, locations, weights, grid_size):
+        """Store the surface points (on the grid_size grid) and weights in the HEATMAP_STORAGE format."""
+        if HEATMAP_STORAGE == "raster":
+            self.surface = encode_surface(locations, weights, grid_size)
+        else:
+            self.geom = f"SRID=4326;{MultiPoint(np.asarray(locations))}"
+            self.weights = [float(weight) for weight in weights]
+
+    def surface_arrays(self):
+        """The surface as (locations, weights) NumPy arrays, whichever format it was stored in."""
+        if self.surface is not None:
+            return decode_surface(self.surface)
+        return shapely.get_coordinates(to_shape(self.geom)), np.asarray(self.weights, dtype=float)
+
+    @property
+    def grid_size(self):
+        """Cell size of the grid the surface was computed on."""
+        if self.surface is not None:
+            return surface_cell_size(self.surface)
+        return (self.kde_params or {}).get("grid_size", 0.001)
+
+    def record_kde(self, kde_info):
+        """Store the density engine settings and timing returned by density.estimate_density."""
+        self.kde_engine = kde_info["engine"]
+        self.kde_params = {key: value for key, value in kde_info.items() if key not in ("engine", "seconds")}
+        self.kde_seconds = kde_info["seconds"]
+
+
+@st.cache_data(max_entries=64)
+def load_surface_overlay(heatmap_id):
+    """PNG overlay (data URL, bounds) of a stored heat map; surfaces never change, so it is cached per id."""
+    from map_layers import surface_overlay
+
+    with session_scope() as session:
+        heatmap = session.get(Heatmap, heatmap_id)
+    locations, weights = heatmap.surface_arrays()
+    return surface_overlay(locations, weights, heatmap.grid_size)
+
+
+class HeatmapPoint(Base):
+    """
+    One row per heat map point, so nearest-neighbour suggestions can run in PostGIS with the GiST
+    index on geom instead of shipping whole MULTIPOINTs to Python.
+    """
+    __tablename__ = 'heatmap_point'
+
+    id = Column(Integer, primary_key=True)
+    heatmap_id = Column(Integer, ForeignKey('heatmap.id', ondelete='CASCADE'), nullable=False, index=True)
+    geom = Column(Geometry('POINT', srid=4326), nullable=False)  # spatial_index creates the GiST index
+    weight = Column(Float, nullable=False)
+
+    @classmethod
+    def explode(cls, session, heatmap_ids):
+        """
+        Copies the points and weights of the given heat maps into heatmap_point. MULTIPOINT heat maps are
+        exploded server side; raster surfaces are decoded here and inserted in bulk.
+
+        Runs in the caller's transaction and lets errors propagate, so a heat map is never committed as
+        current without its points.
+        """
+        statement = text(
+            "INSERT INTO heatmap_point (heatmap_id, geom, weight) "
+            "SELECT heatmap.id, dump.geom, heatmap.weights[dump.path[1]] "
+            "FROM heatmap, ST_DumpPoints(heatmap.geom) AS dump "
+            "WHERE heatmap.id = ANY(:ids) AND heatmap.surface IS NULL"
+        )
+        session.execute(statement, {"ids": list(heatmap_ids)})
+        surfaces = session.query(Heatmap.id, Heatmap.surface).filter(
+            Heatmap.id.in_(heatmap_ids), Heatmap.surface.isnot(None))
+        for heatmap_id, surface in surfaces:
+            locations, weights = decode_surface(surface)
+            session.execute(insert(cls), [
+                {"heatmap_id": heatmap_id, "geom": f"SRID=4326;POINT({lat} {lon})", "weight": float(weight)}
+                for (lat, lon), weight in zip(locations, weights)
+            ])
+
+    @classmethod
+    def backfill(cls, session):
+        """Explodes the current heat maps stored before heatmap_point existed. Returns how many were added."""
+        missing = [heatmap_id for heatmap_id, in session.query(Heatmap.id).filter(Heatmap.is_current.is_(True)).filter(
+            ~exists().where(cls.heatmap_id == Heatmap.id))]
+        if missing:
+            try:
+                cls.explode(session, missing)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error exploding HeatMap points: {e}", exc_info=True)
+                raise
+        return len(missing)
 
-# Create tables if they don't exist
-Base.metadata.create_all(engine)
 
 
 
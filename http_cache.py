@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(os.environ.get("HTTP_CACHE_DIR", ".http_cache"))
+CACHE_MAX_BYTES = int(os.environ.get("HTTP_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+DEFAULT_TTL = 24 * 3600
+
+
+class ResponseCache:
+    """
+    Persistent cache of JSON API responses.
+
+    Entries are gzip-compressed files named by the SHA-256 of the URL and its sorted query
+    parameters. They expire ttl seconds after being written, and once the cache grows past max_bytes
+    the least recently read entries are evicted. hits/misses count lookups since start-up; stats(since=...)
+    gives the lookups of one run.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=DEFAULT_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(url, params=None):
+        request = json.dumps([url, sorted((params or {}).items())], ensure_ascii=False)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return self.directory / key[:2] / f"{key}.json.gz"
+
+    def get(self, url, params=None, ttl=None):
+        """The cached payload, or None when missing or older than ttl (defaults to the cache's ttl)."""
+        path = self.path(self.key(url, params))
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            written = path.stat().st_mtime
+            if time.time() - written > ttl:
+                raise FileNotFoundError(path)
+            payload = json.loads(gzip.decompress(path.read_bytes()))
+            # The access time orders the LRU eviction, the modification time the expiry
+            os.utime(path, (time.time(), written))
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return payload
+
+    def put(self, url, params, payload):
+        path = self.path(self.key(url, params))
+        data = gzip.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+        try:
+            replaced = path.stat().st_size if path.exists() else 0
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = path.with_suffix(f".{threading.get_ident()}.tmp")
+            temporary.write_bytes(data)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.error(f"Error writing HTTP cache entry {path}: {e}", exc_info=True)
+            return
+        with self.lock:
+            if self.size is None:
+                self.size = sum(entry.stat().st_size for entry in self.entries())
+            else:
+                self.size += len(data) - replaced
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def entries(self):
+        return self.directory.glob("*/*.json.gz")
+
+    def evict(self):
+        """Delete the least recently read entries until the cache is under 90% of max_bytes."""
+        entries = sorted(((entry.stat(), entry) for entry in self.entries()), key=lambda item: item[0].st_atime)
+        self.size = sum(stat.st_size for stat, _ in entries)
+        for stat, entry in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            entry.unlink(missing_ok=True)
+            self.size -= stat.st_size
+
+    def stats(self, since=None):
+        """Lookup counts since start-up, or since an earlier stats() snapshot."""
+        stats = {"hits": self.hits, "misses": self.misses}
+        if since is not None:
+            stats = {name: count - since[name] for name, count in stats.items()}
+        return stats
+
+
+response_cache = ResponseCache()
+
+
+def cached_get_json(url, params=None, ttl=None, session=None, cache=response_cache):
+    """GET a JSON API through the response cache; non-200 responses return {} and are not cached."""
+    payload = cache.get(url, params, ttl)
+    if payload is not None:
+        return payload
+    response = (session or requests).get(url, params=params)
+    if response.status_code != 200:
+        return {}
+    payload = response.json()
+    cache.put(url, params, payload)
+    return payload
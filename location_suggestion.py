@@ -1,43 +1,58 @@
 from heatmaps import Heatmap
-from districts import District, select_district, BannedDistrict
-from dbhandler import db_handler
+from districts import select_district, BannedDistrict, PolygonEntity, load_district
+from dbhandler import session_scope
+from data_versions import DISTRICT_MARGIN, data_version
 import folium
 import numpy as np
+import shapely
 import streamlit as st
 from folium.plugins import HeatMap
-from geoalchemy2.shape import to_shape
-from scipy.spatial.distance import cdist  # For filtering based on buffer distance
-from shapely import Point, Polygon, MultiPoint
-from sklearn.neighbors import KernelDensity
-from sqlalchemy import func
+from sqlalchemy import func, select
 from categories import select_category
 from locations import Location
-from sklearn.cluster import DBSCAN
-
-
-def district_hash_func(district):
-    return district.id
-
-
-@st.cache_data(ttl=600, hash_funcs={District: district_hash_func})
-def fetch_data(_session, district, subcategory):
-    district_polygon = Polygon(to_shape(district.geom))
-    district_centroid = district_polygon.centroid
-    restaurants = (
-        _session.query(func.ST_X(Location.geom).label("latitude"), func.ST_Y(Location.geom).label("longitude"),
-                       Location.name)
-        .filter(Location.subcategory == subcategory)
-        .filter(func.ST_DWithin(Location.geom, district.geom, 0.01))
-        .all()
-    )
-
+from spatial import low_density_candidates, group_peaks, grid_components
+from density import district_density, DENSITY_ENGINES, select_kde_params
+from map_layers import MAP_RENDER_MODES, add_business_layer, add_heat_cell_layer, add_surface_overlay, \
+    surface_overlay
+
+
+@st.cache_data(max_entries=64)
+def fetch_data(district_id, subcategory, version):
+    """
+    Businesses of the subcategory around the district and the banned zones crossing it, as compact arrays:
+    (coords, names, banned_names, banned_wkb) with coords an N×2 float array of (lat, lon). Cached by district
+    id, subcategory and their data_version, so a new scrape or banned zone is picked up at once.
+    """
+    district = load_district(district_id)
+    # A short-lived session, so no connection stays checked out during the KDE run that follows
+    with session_scope() as session:
+        restaurants = session.execute(
+            select(func.ST_X(Location.geom), func.ST_Y(Location.geom), Location.name)
+            .where(Location.subcategory == subcategory)
+            .where(func.ST_DWithin(Location.geom, district.geom, DISTRICT_MARGIN))
+        ).all()
+        # Get banned zones that intersect with the district
+        banned_districts = session.execute(
+            select(BannedDistrict.name, func.ST_AsBinary(BannedDistrict.geom))
+            .where(func.ST_Intersects(BannedDistrict.geom, district.geom))
+            .order_by(BannedDistrict.id)
+        ).all()
+
+    coords = np.array([(lat, lon) for lat, lon, _ in restaurants], dtype=float).reshape(-1, 2)
+    names = np.array([name or "" for _, _, name in restaurants], dtype=str)
+    banned_names = np.array([name or "" for name, _ in banned_districts], dtype=str)
+    banned_wkb = [bytes(wkb) for _, wkb in banned_districts]
+    return coords, names, banned_names, banned_wkb
+
+
+def build_base_map(district, coords, names, banned_names, banned_polys, render_mode="markers"):
+    """The district outline, its businesses and the banned zones crossing it, on a new folium map."""
+    district_centroid = district.shape.centroid
     city_map = folium.Map(location=[district_centroid.x, district_centroid.y], zoom_start=12)
 
     district_group = folium.FeatureGroup(name="District").add_to(city_map)
-    pp = to_shape(district.geom)
-    pp = Polygon(pp)
     folium.Polygon(
-        locations=[(lon, lat) for lon, lat in pp.exterior.coords],
+        locations=district.display_ring(),
         color="grey",
         weight=1,
         fill=True,
@@ -47,177 +62,77 @@ def fetch_data(_session, district, subcategory):
     ).add_to(district_group)
 
     locations_group = folium.FeatureGroup(name="Locations").add_to(city_map)
-    for point in restaurants:
-        folium.CircleMarker(
-            location=[point.latitude, point.longitude],
-            radius=3,
-            color='black',
-            fill=True,
-            fill_color='blue',
-            popup="<b>" + point.name + "</b>"
-        ).add_to(locations_group)
+    add_business_layer(locations_group, coords, names.tolist(), render_mode)
     # folium.LayerControl().add_to(city_map)
 
-    # Convert the result to a NumPy array
-    coords = np.array([(point.latitude, point.longitude) for point in restaurants])
-
-    if len(coords) == 0:
-        st.warning("No coordinates found for the selected category and district.")
-        return None, city_map, None
-
-    # Get banned zones that intersect with the district
-    banned_districts = _session.query(BannedDistrict).filter(
-        func.ST_Intersects(BannedDistrict.geom, district.geom)
-    ).all()
-
     banned_districts_group = folium.FeatureGroup(name="Banned Districts").add_to(city_map)
-    for banned_district in banned_districts:
-        banned_district.add_to_map(banned_districts_group, 'red')
-    # Create composite mask
-    banned_polys = [to_shape(bz.geom) for bz in banned_districts]
-
-    return coords, city_map, banned_polys
-
-
-def banned_polys_hash_func(banned_polys):
-    return str(banned_polys)
-
-
-@st.cache_data(ttl=6000, hash_funcs={District: district_hash_func, list: banned_polys_hash_func})
-def kde_module(coords, district, banned_polys):
-    # Fit KDE model
-
-    kde = KernelDensity(kernel="gaussian", bandwidth='silverman',
-                        metric='haversine')  # Bandwidth controls smoothness
-    kde.fit(np.radians(coords))  # Convert to radians for haversine metric
-
+    # Drawn from fetch_data's rows, which follow the data version, so a zone banned by another process shows
+    # up together with the hole it leaves in the heat map
+    for name, polygon in zip(banned_names.tolist(), banned_polys):
+        folium.Polygon(
+            locations=PolygonEntity.simplified_rings(polygon)["district"],
+            color='red',
+            fill=True,
+            fill_opacity=0.3,
+            tooltip=f"{BannedDistrict.__name__}: {name}"
+        ).add_to(banned_districts_group)
+    return city_map
+
+
+@st.cache_data(max_entries=32)
+def kde_module(_coords, district_id, subcategory, version, _banned_polys, engine="exact", grid_size=0.001,
+               kde_params=None):
+    """
+    Density surface of the district. _coords and _banned_polys are fetch_data's for the same district,
+    subcategory and version, so the version stands in for them in the cache key instead of hashing them.
+    """
     # GridSearchCV for Hyper-parameter tuning. maybe later someday...
     # bandwidths = np.logspace(-3, 0, 30)
     # grid = GridSearchCV(KernelDensity(kernel='gaussian'), {'bandwidth': bandwidths}, cv=5)
     # grid.fit(np.radians(coords))
     # kde = grid.best_estimator_
 
-    # Get the bounding box of all locations
-    # min_lat, max_lat = min(coords[:, 0]), max(coords[:, 0])
-    # min_lon, max_lon = min(coords[:, 1]), max(coords[:, 1])
-    min_lat, min_lon, max_lat, max_lon = Polygon(to_shape(district.geom)).bounds
-
-    # Define grid size
-    grid_size = 0.001  # Adjust based on your city size
-
-    # Create a grid of latitude and longitude points
-    lat_points = np.arange(min_lat, max_lat, grid_size)
-    lon_points = np.arange(min_lon, max_lon, grid_size)
-    lat_grid, lon_grid = np.meshgrid(lat_points, lon_points)
-    grid_coords = np.column_stack([lat_grid.ravel(), lon_grid.ravel()])
-
-    polygon_shape = to_shape(district.geom)
-    mask = [polygon_shape.contains(Point(lat, lon)) for lat, lon in grid_coords]
-    grid_coords = grid_coords[mask]
-
-    district_poly = to_shape(district.geom)
-
-    mask = []
-    for lat, lon in grid_coords:
-        point = Point(lat, lon)
-        in_district = district_poly.contains(point)
-        in_banned = any(bp.contains(point) for bp in banned_polys)
-        mask.append(in_district and not in_banned)
-
-    # Apply mask
-    valid_grid_coords = grid_coords[mask]
-
-    # Handle empty grid case
-    if len(valid_grid_coords) == 0:
-        return None, None
-    # Evaluate density at each grid point
-    density = np.exp(kde.score_samples(np.radians(valid_grid_coords)))
-
-    # density = density.reshape(lat_grid.shape)
-
-    # Normalize density for better scaling
-    density = (density - density.min()) / (density.max() - density.min())
-
-    return density, valid_grid_coords
+    return district_density(_coords, load_district(district_id).shape, _banned_polys, engine, grid_size, kde_params)
 
 
 # @st.cache_data(ttl=600)
 def heatmap_module(_session, density, grid_coords, coords, _district, _city_map, category, sub_category, percentile,
-                   buffer_distance):
-    # Filter low-density areas
-    low_density_threshold = np.percentile(density[density >= 0], percentile)  # Adjust threshold as needed
-    low_density_mask = density < low_density_threshold
-
-    low_density_locations = grid_coords[low_density_mask.ravel()]
-
-    # Filter suggested locations with a buffer zone around existing businesses
-    # buffer_distance = 0.005  # Approx ~500 meters, adjust as needed
-    filtered_locations = [
-        coord for coord in low_density_locations
-        if np.min(cdist([coord], coords, metric='euclidean')) >= buffer_distance
-    ]
-
-    # buffer_distance = 500  # Buffer in meters
-    # filtered_locations = [
-    #     coord for coord in low_density_locations
-    #     if all(geodesic(coord, existing_coord).meters >= buffer_distance for existing_coord in coords)
-    # ]
-
-    # Prepare heatmap data with density as weights
-    filtered_density = density[low_density_mask.ravel()]  # Corresponding density for low-density locations
-    filtered_density = filtered_density[[np.min(cdist([coord], coords, metric='euclidean')) >= buffer_distance
-                                         for coord in low_density_locations]]  # Match density with filtered locations
-
-    if len(filtered_locations) == 0:
+                   buffer_distance, kde_info=None, clustering="dbscan", render_mode="markers"):
+    filtered_locations, weights = low_density_candidates(density, grid_coords, coords, percentile, buffer_distance)
+
+    if filtered_locations is None:
         st.error("No locations found for selected category and district with the given parameters.")
         st.toast(":red[No locations found for selected category and district with the given parameters.]", icon='🚨')
-        return _city_map
-    # Normalize weights
-    weights = ((filtered_density - filtered_density.min()) / (filtered_density.max() - filtered_density.min()))
-    # print(weights)
-    weights = 1 - weights
+        return _city_map, None
 
-    heatmap_data = []
+    grid_size = kde_info["grid_size"] if kde_info is not None else 0.001
     heatmap_group = folium.FeatureGroup(name='Heatmap').add_to(_city_map)
-    for coord, weight in zip(filtered_locations, weights):
-        folium.Circle(
-            location=[coord[0], coord[1]],
-            radius=100,
-            color='white',
-            weight=0,
-            fill_opacity=0,
-            fill=False,
-            fill_color='red',
-            popup="<b>" + str(round(weight * 100, 2)) + "</b>"
-        ).add_to(heatmap_group)
-        heatmap_data.append([coord[0], coord[1], weight])
-
-    # heatmap_data = [
-    #     [coord[0], coord[1], weight]
-    #     for coord, weight in zip(filtered_locations, weights)
-    # ]
-
-    filtered_locations = [coord.tolist() for coord in filtered_locations]
-    filtered_locations = MultiPoint(filtered_locations)
+    if render_mode == "image":
+        # One pre-colorized PNG of the surface instead of a point per grid cell
+        add_surface_overlay(heatmap_group, *surface_overlay(filtered_locations, weights, grid_size))
+    else:
+        add_heat_cell_layer(heatmap_group, filtered_locations, weights, render_mode)
+        heatmap_data = np.round(np.column_stack([filtered_locations, weights]), 6).tolist()
+
+        # heatmap_data = [
+        #     [coord[0], coord[1], weight]
+        #     for coord, weight in zip(filtered_locations, weights)
+        # ]
+
+        # Add heat map for filtered locations
+        HeatMap(heatmap_data, control=True).add_to(_city_map)
     weights = weights.tolist()
-    # Add heat map for filtered locations
-    HeatMap(heatmap_data, control=True).add_to(_city_map)
 
-    heatmap = Heatmap(geom=f"SRID=4326;{filtered_locations}", weights=weights, district=_district, category=category,
-                      subcategory=sub_category, buffer_distance=buffer_distance, percentile=percentile)
+    heatmap = Heatmap(district_id=_district.id, category=category, subcategory=sub_category,
+                      buffer_distance=buffer_distance, percentile=percentile)
+    heatmap.set_surface(filtered_locations, weights, grid_size)
+    if kde_info is not None:
+        heatmap.record_kde(kde_info)
     heatmap.add_to_db(_session)
 
-    multipoint = MultiPoint(filtered_locations)
-    if isinstance(multipoint, MultiPoint):
-        # Extract individual points from the MultiPoint
-        points = np.array([[point.x, point.y] for point in multipoint.geoms])
-    else:
-        # Handle the case where it's a single Point
-        points = np.array([[multipoint.x, multipoint.y]])
     # Cluster the points and mark the highest density points
 
-    weights = heatmap.weights
-    highest_density_points = cluster_points(points, weights)
+    highest_density_points = cluster_points(filtered_locations, weights, method=clustering, grid_size=grid_size)
     # Add markers for the highest density points
     highest_density_points_group = folium.FeatureGroup(name="Highest Density Points").add_to(_city_map)
     for point in highest_density_points:
@@ -236,53 +151,50 @@ def heatmap_module(_session, density, grid_coords, coords, _district, _city_map,
 
 
 
-@st.cache_data(ttl=6000)
-def cluster_points(points, weights, eps=0.00003, min_samples=1):
-    """Cluster points using DBSCAN and return the highest density point in each cluster."""
-    # Perform DBSCAN clustering
-    db = DBSCAN(eps=eps, min_samples=min_samples, metric='haversine').fit(np.radians(points))
-    labels = db.labels_
-
-    # Debugging: Print the number of clusters and noise points
-    unique_labels = set(labels)
-    num_clusters = len(unique_labels) - (1 if -1 in unique_labels else 0)  # Exclude noise
-    num_noise = list(labels).count(-1)
-    st.write(f":green[Number of clusters: {num_clusters}]")
-
-    # Group points and weights by cluster
-    clusters = {}
-    for i, label in enumerate(labels):
-        if label not in clusters:
-            clusters[label] = []
-        clusters[label].append((points[i], weights[i]))
-
-    # Find the highest density point in each cluster
-    highest_density_points = []
-    for label, points_in_cluster in clusters.items():
-        if label != -1:  # Ignore noise points (label = -1)
-            # Find the point with the highest weight in the cluster
-            highest_density_point = max(points_in_cluster, key=lambda x: x[1])
-            print(highest_density_point)
-            highest_density_points.append(highest_density_point)  # Append the point coordinates
+@st.cache_data(max_entries=32)
+def cluster_points(points, weights, eps=0.00003, min_samples=1, method="dbscan", grid_size=0.001):
+    """
+    Cluster points and return the highest density point in each cluster.
 
-    return highest_density_points
+    method "dbscan" runs haversine DBSCAN; "grid" takes the connected components of the occupied
+    grid_size cells instead, which is much faster since heat map points lie on the KDE grid.
+    Cached on the points and weights themselves, which change exactly when the heat map does.
+    """
+    points = np.asarray(points)
+    if method == "grid":
+        labels = grid_components(points, grid_size)
+    else:
+        from sklearn.cluster import DBSCAN  # Imported on first use: sklearn is slow to import
+
+        db = DBSCAN(eps=eps, min_samples=min_samples, metric='haversine').fit(np.radians(points))
+        labels = db.labels_
 
+    # Find the highest density point in each cluster (noise points, label -1, are ignored)
+    peaks = group_peaks(labels, weights)
+    st.write(f":green[Number of clusters: {len(peaks)}]")
 
-# @st.cache_data(ttl=6000, hash_funcs={District: district_hash_func})
-def generate_heatmap(buffer_distance, percentile, selected_category, selected_sub_category, selected_district, _session):
+    return [(points[i], weights[i]) for i in peaks]
+
+
+def generate_heatmap(buffer_distance, percentile, selected_category, selected_sub_category, selected_district, _session,
+                     engine="exact", clustering="dbscan", render_mode="markers", kde_params=None):
     with st.status("Generating heat map...", expanded=True) as status:
         progress_text = "Operation in progress. Please wait."
         percent_complete = 0
         sp_bar = st.progress(percent_complete, text=progress_text)
         st.write("Fetching data...")
-        coords, city_map, banned_polys = fetch_data(_session, selected_district, selected_sub_category)
+        version = data_version(selected_district.id, selected_sub_category)
+        coords, names, banned_names, banned_wkb = fetch_data(selected_district.id, selected_sub_category, version)
         percent_complete = 30
         sp_bar.progress(percent_complete, text=progress_text)
 
-        if coords is not None:
+        if len(coords) > 0:
+            banned_polys = [shapely.from_wkb(wkb) for wkb in banned_wkb]
+            city_map = build_base_map(selected_district, coords, names, banned_names, banned_polys, render_mode)
             st.write(f":green[{len(coords)} existing businesses found!]")
             st.write("Running kde module...")
-            density, grid_coords = kde_module(coords, selected_district, banned_polys)
+            density, grid_coords, kde_info = kde_module(coords, selected_district.id, selected_sub_category, version,
+                                                        banned_polys, engine, kde_params=kde_params)
             if density is None or grid_coords is None:
                 st.error("No valid locations after applying banned district filters")
                 return None
@@ -295,7 +207,7 @@ def generate_heatmap(buffer_distance, percentile, selected_category, selected_su
                                                               selected_district, city_map,
                                                               selected_category,
                                                               selected_sub_category, percentile,
-                                                              buffer_distance)
+                                                              buffer_distance, kde_info, clustering, render_mode)
             percent_complete = 80
             sp_bar.progress(percent_complete, text=progress_text)
 
@@ -349,16 +261,30 @@ def location_suggestion():
             buffer_distance = st.number_input("Buffer distance(m):)", 0, 10000, 500) / 100000
         with col2:
             percentile = st.slider("Percentile:", 0, 100, 50)
+        col1, col2, col3 = st.columns([0.34, 0.33, 0.33])
+        with col1:
+            engine = st.selectbox("Density engine:", DENSITY_ENGINES,
+                                  help="exact: haversine KDE at every grid point, approximate: ball tree KDE with "
+                                       "automatic tolerances, binned: fast FFT approximation")
+        with col2:
+            clustering = st.selectbox("Peak clustering:", ["dbscan", "grid"],
+                                      help="dbscan: haversine DBSCAN, grid: connected cells of the KDE grid (faster)")
+        with col3:
+            render_mode = st.selectbox("Map rendering:", MAP_RENDER_MODES, index=1,
+                                       help="markers: one map object per point, geojson: one layer per group "
+                                            "(much lighter for dense districts), image: the heat map as a "
+                                            "single picture")
+        kde_params = select_kde_params(engine)
 
     col1, col2 = st.columns([0.4, 0.6])
 
     with col1:
         if st.button("Generate", type='primary'):
-            session = db_handler()
-            highest_density_points = generate_heatmap(buffer_distance, percentile, selected_category,
-                                                      selected_sub_category, selected_district, session)
+            with session_scope() as session:
+                highest_density_points = generate_heatmap(buffer_distance, percentile, selected_category,
+                                                          selected_sub_category, selected_district, session, engine,
+                                                          clustering, render_mode, kde_params)
             st.session_state.highest_density_points = highest_density_points
-            session.close()
     with col2:
         if st.button("Clear"):
             st.session_state.heatmap_generated = False
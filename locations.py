@@ -1,7 +1,9 @@
 from sqlalchemy import Column, Integer, String, Numeric
+from sqlalchemy.dialects.postgresql import insert
 from geoalchemy2 import Geometry
 import logging
-from dbhandler import Base, engine
+from dbhandler import Base
+from data_versions import DataVersion
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -31,26 +33,71 @@ class Location(Base):
     #         session.close()
 
     def add_to_db(self, session):
-        """Adds the current Location object to the database."""
-        existing = session.query(self.__class__).filter(self.__class__.token == self.token).first()
-
-        if existing:
-            logger.info(f"{self.__class__.__name__} '{self.name}' already exists. Skipping addition.")
-            return
-
-        try:
-            session.add(self)
-            session.commit()
-            print(f"Location '{self.name}' added successfully!")
-            logger.info(f"Location '{self.name}' added successfully!")
-        except Exception as e:
-            session.rollback()
-            print(f"Error adding Location: {e}")
-            logger.error(f"Error adding Location: {e}", exc_info=True)
-
-
-# Create tables if they don't exist
-Base.metadata.create_all(engine)
+        """
+        Adds the current Location object to the database through bulk_add, so the district data versions are
+        bumped like for scraped batches. Returns True when it was inserted, False when its token already existed.
+        """
+        row = {column.name: getattr(self, column.name) for column in self.__table__.columns
+               if getattr(self, column.name) is not None}
+        inserted, _ = self.bulk_add(session, [row])
+        return inserted == 1
+
+    @classmethod
+    def bulk_add(cls, session, rows, batch_size=1000):
+        """
+        Inserts location rows (dicts of column values) with one INSERT ... ON CONFLICT (token) DO NOTHING
+        per batch and returns the (inserted, skipped) counts. The data versions of the districts around the
+        inserted rows are bumped in the same transaction.
+        """
+        inserted = 0
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            statement = (
+                insert(cls).values(batch)
+                .on_conflict_do_nothing(index_elements=[cls.token])
+                .returning(cls.id)
+            )
+            try:
+                ids = [location_id for location_id, in session.execute(statement).fetchall()]
+                DataVersion.bump_for_locations(session, ids)
+                session.commit()
+                inserted += len(ids)
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Error adding Locations: {e}", exc_info=True)
+                raise
+        logger.info(f"{inserted} Locations added, {len(rows) - inserted} already existed.")
+        return inserted, len(rows) - inserted
+
+
+class LocationBatch:
+    """Accumulates location rows and writes them through Location.bulk_add once batch_size rows are pending."""
+
+    def __init__(self, session, batch_size=1000):
+        self.session = session
+        self.batch_size = batch_size
+        self.rows = []
+        self.inserted = 0
+        self.skipped = 0
+
+    def add(self, **row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            inserted, skipped = Location.bulk_add(self.session, self.rows, self.batch_size)
+            self.inserted += inserted
+            self.skipped += skipped
+            self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
 
 # Usage example
 if __name__ == "__main__":
@@ -1,11 +1,40 @@
+import importlib
+
 import streamlit as st
 
-import districts
-import location_suggestion
-import scrape
-import heatmaps
-import business_suggestion
-from test import test
+from dbhandler import Base, missing_schema, pool_status
+
+
+@st.cache_resource
+def verified_schemas():
+    """Sets of tables already found up to date, shared by every session of the app."""
+    return set()
+
+
+def check_schema():
+    """
+    Stop the page with an explanation when the database lacks tables or columns of the loaded models,
+    i.e. python migrate.py was not run after an update, instead of failing later in a query.
+    """
+    tables = frozenset(Base.metadata.tables)
+    if tables in verified_schemas():
+        return
+    missing = missing_schema(Base.metadata.tables.values())
+    if missing:
+        st.error(f"The database schema is out of date (missing {', '.join(missing)}). "
+                 f"Run :grey-background[python migrate.py] and reload the page.")
+        st.stop()
+    verified_schemas().add(tables)
+
+
+def lazy_page(module_name, function_name):
+    """Page callable that imports its module on first use, so start-up only loads the page being opened."""
+    def page():
+        module = importlib.import_module(module_name)
+        check_schema()  # The module registered its models, check their tables before using them
+        getattr(module, function_name)()
+    page.__name__ = function_name  # st.Page derives the page URL from it
+    return page
 
 
 # st.sidebar.title("Navigation")
@@ -23,6 +52,7 @@ def home():
     st.write("- Dr Somaye Sayari")
     st.divider()
     st.subheader("Help")
+    st.write("- Run :grey-background[python migrate.py] once after installing or updating the app to create or upgrade the database tables.")
     st.write("- There are already locations available from these subcategories: <br>:grey[بیمارستان, تعمیرگاه خودرو, رستوران, سوپرمارکت]", unsafe_allow_html=True)
     st.write("- If you want to run analysis on other subcategories, you should first scrape data in :grey-background[🔍Scrape data] section.")
     st.write("- if you want to use the :grey-background[💼Business Suggestion] section, you should first generate heat maps :grey[(with 100% percnetile)] for the desired district in the :grey-background[🔥Generate heat maps] section.")
@@ -33,26 +63,31 @@ pages = {
         st.Page(home, title="Home", icon='🏠'),
     ],
     "Districts": [
-        st.Page(districts.extract_tehran_districts, title="Extract districts", icon='🗺️️'),
-        st.Page(districts.add_district, title="Add district", icon='➕'),
-        st.Page(districts.add_banned_district, title="Add banned district", icon='✖️'),
+        st.Page(lazy_page("districts", "extract_tehran_districts"), title="Extract districts", icon='🗺️️'),
+        st.Page(lazy_page("districts", "add_district"), title="Add district", icon='➕'),
+        st.Page(lazy_page("districts", "add_banned_district"), title="Add banned district", icon='✖️'),
     ],
     "Locations": [
-        st.Page(scrape.scrape_data, title="Scrape data", icon='🔍'),
+        st.Page(lazy_page("scrape", "scrape_data"), title="Scrape data", icon='🔍'),
     ],
     "Heat Maps": [
-        st.Page(business_suggestion.generate_heatmaps, title="Generate heat maps", icon='🔥'),
+        st.Page(lazy_page("business_suggestion", "generate_heatmaps"), title="Generate heat maps", icon='🔥'),
     ],
     "Location suggestion": [
-        st.Page(location_suggestion.location_suggestion, title="Location suggestion", icon='📍'),
+        st.Page(lazy_page("location_suggestion", "location_suggestion"), title="Location suggestion", icon='📍'),
     ],
     "Business suggestion": [
-        st.Page(business_suggestion.display_suggestions, title="Business suggestion", icon='💼'),
+        st.Page(lazy_page("business_suggestion", "display_suggestions"), title="Business suggestion", icon='💼'),
+        st.Page(lazy_page("business_suggestion", "batch_scoring"), title="Batch scoring", icon='📋'),
     ]
 }
 pg = st.navigation(pages)
 pg.run()
 
+pool = pool_status()
+st.sidebar.caption(f"Database connections: {pool['checked_out']}/{pool['capacity']} in use, "
+                   f"peak {pool['peak_checked_out']}")
+
 # app_mode = st.sidebar.selectbox(
 #     placeholder="Mode",
 #     label="Choose an app mode",
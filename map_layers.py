@@ -0,0 +1,105 @@
+import folium
+import numpy as np
+from folium.raster_layers import ImageOverlay
+from folium.utilities import image_to_url
+
+from raster import rasterize
+
+# "markers" adds one folium object per point, "geojson" a single GeoJSON layer per group and "image"
+# also replaces the heat map points with one pre-colorized PNG of the surface
+MAP_RENDER_MODES = ("markers", "geojson", "image")
+
+# Leaflet.heat's default gradient, so the image overlay reads like the HeatMap plugin
+HEAT_GRADIENT = ((0.4, (0, 0, 255)), (0.6, (0, 255, 255)), (0.7, (0, 255, 0)), (0.8, (255, 255, 0)), (1.0, (255, 0, 0)))
+
+
+def point_features(locations, properties):
+    """GeoJSON FeatureCollection of (lat, lon) points; properties maps a name to one value per point."""
+    locations = np.round(np.asarray(locations, dtype=float).reshape(-1, 2), 6)
+    columns = {name: list(values) for name, values in properties.items()}
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},  # GeoJSON is (lon, lat)
+                "properties": {name: values[i] for name, values in columns.items()},
+            }
+            for i, (lat, lon) in enumerate(locations.tolist())
+        ],
+    }
+
+
+def add_business_layer(group, locations, names, mode="markers"):
+    """Existing businesses as small blue circles with their name as popup."""
+    if mode != "markers":
+        folium.GeoJson(
+            point_features(locations, {"name": names}),
+            marker=folium.CircleMarker(radius=3, color='black', fill=True, fill_color='blue', fill_opacity=0.2),
+            popup=folium.GeoJsonPopup(fields=["name"], labels=False),
+        ).add_to(group)
+        return group
+    for (lat, lon), name in zip(locations, names):
+        folium.CircleMarker(
+            location=[lat, lon],
+            radius=3,
+            color='black',
+            fill=True,
+            fill_color='blue',
+            popup="<b>" + name + "</b>"
+        ).add_to(group)
+    return group
+
+
+def add_heat_cell_layer(group, locations, weights, mode="markers"):
+    """Invisible 100 m circles on the heat map cells showing their weight (in %) when clicked."""
+    if mode == "geojson":
+        folium.GeoJson(
+            point_features(locations, {"weight": np.round(np.asarray(weights, dtype=float) * 100, 2).tolist()}),
+            marker=folium.Circle(radius=100, weight=0, fill=False, fill_opacity=0),
+            popup=folium.GeoJsonPopup(fields=["weight"], labels=False),
+        ).add_to(group)
+        return group
+    for coord, weight in zip(locations, weights):
+        folium.Circle(
+            location=[coord[0], coord[1]],
+            radius=100,
+            color='white',
+            weight=0,
+            fill_opacity=0,
+            fill=False,
+            fill_color='red',
+            popup="<b>" + str(round(weight * 100, 2)) + "</b>"
+        ).add_to(group)
+    return group
+
+
+def colorize(grid):
+    """RGBA image of a weight grid in [0, 1] along HEAT_GRADIENT, transparent where the grid is NaN."""
+    stops = np.array([0.0] + [stop for stop, _ in HEAT_GRADIENT])
+    colors = np.array([HEAT_GRADIENT[0][1]] + [color for _, color in HEAT_GRADIENT], dtype=float)
+    valid = np.isfinite(grid)
+    values = np.clip(np.where(valid, grid, 0), 0, 1)
+    image = np.zeros(grid.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        image[..., channel] = np.interp(values, stops, colors[:, channel])
+    image[..., 3] = np.where(valid, np.interp(values, [0, 1], [80, 230]), 0)
+    return image
+
+
+def surface_overlay(locations, weights, grid_size):
+    """
+    The heat map surface as a PNG data URL with one pixel per grid cell, and its [[south, west],
+    [north, east]] bounds. Its size depends on the district's extent, not on how many points it has.
+    Rows are spaced linearly in latitude, which is indistinguishable from Web Mercator at district scale.
+    """
+    origin, grid = rasterize(locations, weights, grid_size)
+    south, west = origin - grid_size / 2
+    north, east = origin + (np.array(grid.shape) - 0.5) * grid_size
+    bounds = [[float(south), float(west)], [float(north), float(east)]]
+    return image_to_url(colorize(grid[::-1])), bounds  # image rows run north to south
+
+
+def add_surface_overlay(group, url, bounds, opacity=0.8):
+    ImageOverlay(url, bounds, opacity=opacity, pixelated=False).add_to(group)
+    return group
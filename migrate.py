@@ -0,0 +1,44 @@
+"""
+Create and upgrade the database schema.
+
+The model modules no longer touch the database when imported; run this once after installing or
+updating the app (it is idempotent):
+    python migrate.py
+"""
+import logging
+
+from dbhandler import Base, engine, add_missing_columns, drop_not_null, session_scope
+from data_versions import DataVersion  # noqa: F401 (registers the table)
+from districts import District, BannedDistrict
+from heatmaps import Heatmap, HeatmapPoint
+from locations import Location  # noqa: F401 (registers the table)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def migrate():
+    # Create tables if they don't exist
+    Base.metadata.create_all(engine)
+
+    # create_all never alters existing tables: add new columns, relax constraints and create new indexes
+    for table in (District.__table__, BannedDistrict.__table__, Heatmap.__table__):
+        add_missing_columns(table)
+    drop_not_null(Heatmap.__table__)
+    for index in Heatmap.__table__.indexes:
+        index.create(engine, checkfirst=True)
+
+    with session_scope() as session:
+        # Simplified display geometries of districts and banned zones stored before display_geoms existed
+        District.backfill_display_geoms(session)
+        BannedDistrict.backfill_display_geoms(session)
+        # Heat maps stored before is_current existed
+        if session.query(Heatmap.id).filter(Heatmap.is_current.is_(None)).first() is not None:
+            Heatmap.refresh_current(session)
+        # Current heat maps stored before heatmap_point existed
+        exploded = HeatmapPoint.backfill(session)
+    logger.info(f"Schema up to date ({exploded} heat maps indexed for server-side suggestions).")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,82 @@
+import struct
+import zlib
+
+import numpy as np
+
+# Header: magic, format version, origin (lat, lon), cell size in degrees, raster shape (rows, cols)
+HEADER = struct.Struct("<4sBdddII")
+MAGIC = b"HMR1"
+VERSION = 1
+
+
+def encode_surface(locations, weights, grid_size):
+    """
+    Pack heat map points lying on a regular grid into a compact binary raster.
+
+    The points are snapped to the grid starting at their minimum (lat, lon) with grid_size cells.
+    The payload is a bit mask of the occupied cells followed by their weights as float32, stored
+    byte-shuffled (all first bytes, then all second bytes, ...) and zlib-compressed, which keeps the
+    smooth weight surfaces small.
+    """
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+    weights = np.asarray(weights, dtype=np.float32).ravel()
+    if len(locations) == 0:
+        raise ValueError("Cannot encode an empty surface.")
+    origin = locations.min(axis=0)
+    cells = np.rint((locations - origin) / grid_size).astype(np.int64)
+    rows, cols = cells.max(axis=0) + 1
+
+    flat = cells[:, 0] * cols + cells[:, 1]
+    order = np.argsort(flat, kind="stable")
+    flat = flat[order]
+    if len(flat) > 1 and (np.diff(flat) == 0).any():
+        raise ValueError("Several points fall into the same grid cell; is grid_size the grid's cell size?")
+    mask = np.zeros(rows * cols, dtype=bool)
+    mask[flat] = True
+
+    shuffled = weights[order].view(np.uint8).reshape(-1, 4).T.tobytes()
+    payload = zlib.compress(np.packbits(mask).tobytes() + shuffled, 6)
+    return HEADER.pack(MAGIC, VERSION, origin[0], origin[1], grid_size, rows, cols) + payload
+
+
+def decode_raster(blob):
+    """Unpack a surface into (origin, grid_size, mask, values): mask is a rows×cols boolean array and
+    values the float32 weights of its True cells in row-major order."""
+    magic, version, origin_lat, origin_lon, grid_size, rows, cols = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a heat map raster.")
+    payload = zlib.decompress(memoryview(blob)[HEADER.size:])
+    mask_bytes = (rows * cols + 7) // 8
+    mask = np.unpackbits(np.frombuffer(payload, np.uint8, mask_bytes), count=rows * cols).astype(bool)
+    values = np.frombuffer(payload, np.uint8, offset=mask_bytes).reshape(4, -1).T.copy().view(np.float32).ravel()
+    return np.array([origin_lat, origin_lon]), grid_size, mask.reshape(rows, cols), values
+
+
+def decode_surface(blob):
+    """Unpack a surface into (locations, weights): an N×2 array of (lat, lon) and an N array of weights."""
+    origin, grid_size, mask, values = decode_raster(blob)
+    cells = np.argwhere(mask)
+    return origin + cells * grid_size, values.astype(float)
+
+
+def surface_grid(blob):
+    """The surface as a dense rows×cols float array (NaN outside the mask) with its origin and cell size."""
+    origin, grid_size, mask, values = decode_raster(blob)
+    grid = np.full(mask.shape, np.nan)
+    grid[mask] = values
+    return origin, grid_size, grid
+
+
+def rasterize(locations, weights, grid_size):
+    """Dense (origin, grid) of points on the grid_size grid: grid is rows×cols with NaN at empty cells."""
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+    origin = locations.min(axis=0)
+    cells = np.rint((locations - origin) / grid_size).astype(np.intp)
+    grid = np.full(cells.max(axis=0) + 1, np.nan)
+    grid[cells[:, 0], cells[:, 1]] = weights
+    return origin, grid
+
+
+def surface_cell_size(blob):
+    """Grid cell size of an encoded surface, without decoding it."""
+    return HEADER.unpack_from(blob)[4]
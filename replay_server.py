@@ -0,0 +1,127 @@
+"""
+Local stand-in for the bundle search API that replays recorded responses.
+
+Record responses once against the real API, then point the scrapers at the replay server:
+    python replay_server.py record recordings/ --slug restaurant --subcategory رستوران --district "منطقه 1"
+    python replay_server.py serve recordings/ --port 8765
+    scrape_cells_concurrently(..., base_url="http://127.0.0.1:8765/v4/bundle-search/")
+
+Requests without a recording get a 404, which the scrapers treat as an empty cell.
+"""
+import argparse
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl
+
+import requests
+
+REPLAYED_PARAMS = ("bundle_slug", "text", "polygon", "camera")
+
+
+def recording_key(params):
+    """Stable file name for a bundle search query."""
+    query = json.dumps({name: params.get(name, "") for name in REPLAYED_PARAMS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(query.encode("utf-8")).hexdigest() + ".json"
+
+
+def record_response(directory, params, payload):
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    (path / recording_key(params)).write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+
+
+class ReplayServer:
+    """Threaded HTTP server answering bundle search queries from a directory of recordings."""
+
+    def __init__(self, directory, host="127.0.0.1", port=0, delay=0.0):
+        recordings = Path(directory)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = dict(parse_qsl(urlsplit(self.path).query, keep_blank_values=True))
+                recording = recordings / recording_key(params)
+                if delay:
+                    threading.Event().wait(delay)
+                if not recording.exists():
+                    self.send_error(404)
+                    return
+                body = recording.read_bytes()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v4/bundle-search/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def record_district(directory, district_name, slug, sub_category):
+    """Fetch every cell of a district from the real API and store the responses."""
+    from geoalchemy2.shape import to_shape
+    from shapely import Polygon
+
+    from dbhandler import db_handler
+    from districts import District
+    from scrape import BUNDLE_SEARCH_URL, bundle_search_params, district_cells
+
+    session = db_handler()
+    try:
+        district = session.query(District).filter(District.name == district_name).one()
+        cells, _ = district_cells(list(Polygon(to_shape(district.geom)).exterior.coords))
+    finally:
+        session.close()
+    with requests.Session() as http:
+        for cell in cells:
+            params = bundle_search_params(slug, '', sub_category, cell["centroid"])
+            response = http.get(BUNDLE_SEARCH_URL, params=params)
+            if response.status_code == 200:
+                record_response(directory, params, response.json())
+    return len(cells)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record or replay bundle search responses.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record = subparsers.add_parser("record")
+    record.add_argument("directory")
+    record.add_argument("--district", required=True)
+    record.add_argument("--slug", required=True)
+    record.add_argument("--subcategory", required=True)
+    serve = subparsers.add_parser("serve")
+    serve.add_argument("directory")
+    serve.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        print(f"Recorded {record_district(args.directory, args.district, args.slug, args.subcategory)} cells.")
+    else:
+        replay = ReplayServer(args.directory, port=args.port)
+        print(f"Replaying {args.directory} at {replay.base_url}")
+        replay.server.serve_forever()
@@ -1,19 +1,21 @@
 import json
 
-from geoalchemy2.shape import to_shape
 from shapely import to_geojson
 
 from dbhandler import db_handler
 import streamlit as st
 import requests
 import math
-from shapely.geometry import Polygon, Point, box, MultiPolygon
+from collections import deque
+from shapely.geometry import Polygon, box, MultiPolygon
 import folium
 from streamlit_folium import st_folium
 
 from districts import select_district
-from locations import Location
-from categories import fetch_categories, select_category
+from locations import LocationBatch
+from categories import select_category
+from checkpoints import ScrapeCheckpoint
+from http_cache import cached_get_json, response_cache
 
 
 def fetch_geojson(url):
@@ -55,20 +57,43 @@ def meters_to_degrees(meters, latitude):
     return lat_deg, lon_deg
 
 
+BUNDLE_SEARCH_URL = "https://search.raah.ir/v4/bundle-search/"
+# A bundle search response with this many places is assumed to be truncated
+BUNDLE_SEARCH_RESULT_CAP = 20
+# Adaptive scraping starts from coarse cells and splits saturated ones down to this size
+ADAPTIVE_START_METERS = 2000
+ADAPTIVE_MIN_METERS = 125
+# Maximum age of reused bundle search responses; a checkpoint caps it further (ScrapeCheckpoint.cache_ttl)
+BUNDLE_SEARCH_CACHE_TTL = 12 * 3600
+
 # Cache category data
 
 
-# @st.cache_data(ttl=600)
-def fetch_bundle_search_data(base_url, text, polygon_param, selected_sub_category, camera):
-    request_url = f"{base_url}?bundle_slug={text}&text={selected_sub_category}&polygon={polygon_param}&camera={camera[0]}%2C{camera[1]}"
-    response = requests.get(request_url)
+def bundle_search_params(text, polygon_param, selected_sub_category, camera):
+    return {"bundle_slug": text, "text": selected_sub_category, "polygon": polygon_param,
+            "camera": f"{camera[0]},{camera[1]}"}
+
+
+def parse_bundle_features(bundle_data):
+    """Yield (token, name, rate, (lon, lat)) for every place in a bundle search response."""
+    features = bundle_data.get("geojson", {}).get("features", [])
+    poi_tokens = bundle_data.get("poi-tokens", [])
+    for poi_token, feature in zip(poi_tokens, features):
+        properties = feature.get("properties", {})
+        geometry = feature.get("geometry", {})
+        place_name = properties.get("name", "Unknown Place")
+        rate = properties.get("rate")
+        coordinates = tuple(geometry.get("coordinates", [None, None]))
+        yield poi_token, place_name, rate, coordinates
+
 
-    if response.status_code == 200:
-        return response.json()
-    return {}
+def fetch_bundle_search_data(base_url, text, polygon_param, selected_sub_category, camera,
+                             ttl=BUNDLE_SEARCH_CACHE_TTL):
+    return cached_get_json(base_url, bundle_search_params(text, polygon_param, selected_sub_category, camera), ttl=ttl)
 
 
-def polygon_generator(coords):
+def district_cells(coords, cell_meters=500):
+    """Split the district polygon (lat, lon ring) into cells of about cell_meters, each with its centroid."""
     main_polygon_coords = [(lon, lat) for lat, lon in coords]
     large_polygon = Polygon(main_polygon_coords)
 
@@ -81,7 +106,7 @@ def polygon_generator(coords):
     min_lon = min(coord[0] for coord in main_polygon_coords)
     max_lon = max(coord[0] for coord in main_polygon_coords)
 
-    lat_step, lon_step = meters_to_degrees(500, min_lat)
+    lat_step, lon_step = meters_to_degrees(cell_meters, min_lat)
 
     grid_cells = []
     lat = min_lat
@@ -93,14 +118,46 @@ def polygon_generator(coords):
             lon += lon_step
         lat += lat_step
 
-    smaller_polygons = [
-        cell.intersection(large_polygon) for cell in grid_cells if cell.intersects(large_polygon)
-    ]
-    smaller_polygons = [poly for poly in smaller_polygons if not poly.is_empty]
+    return clip_cells(grid_cells, large_polygon, cell_meters), large_polygon
 
-    polygons_with_centroids = [
-        {"polygon": poly, "centroid": poly.centroid.coords[0]} for poly in smaller_polygons
-    ]
+
+def clip_cells(grid_cells, large_polygon, cell_meters):
+    """Clip grid boxes to the district, dropping the ones outside it."""
+    polygons_with_centroids = []
+    for cell in grid_cells:
+        if not cell.intersects(large_polygon):
+            continue
+        poly = cell.intersection(large_polygon)
+        if not poly.is_empty:
+            polygons_with_centroids.append(
+                {"polygon": poly, "centroid": poly.centroid.coords[0], "box": cell, "meters": cell_meters})
+    return polygons_with_centroids
+
+
+def adaptive_splitter(large_polygon, result_cap=BUNDLE_SEARCH_RESULT_CAP, min_meters=ADAPTIVE_MIN_METERS):
+    """
+    Returns split(cell, bundle_data) for adaptive scraping: a cell whose response came back saturated
+    (result_cap places or more) is split into its four quadrants, down to cells of min_meters.
+    """
+
+    def split(cell, bundle_data):
+        features = bundle_data.get("geojson", {}).get("features", [])
+        if len(features) < result_cap or cell["meters"] / 2 < min_meters:
+            return []
+        min_lon, min_lat, max_lon, max_lat = cell["box"].bounds
+        mid_lon, mid_lat = (min_lon + max_lon) / 2, (min_lat + max_lat) / 2
+        quadrants = [
+            box(min_lon, min_lat, mid_lon, mid_lat), box(mid_lon, min_lat, max_lon, mid_lat),
+            box(min_lon, mid_lat, mid_lon, max_lat), box(mid_lon, mid_lat, max_lon, max_lat),
+        ]
+        return clip_cells(quadrants, large_polygon, cell["meters"] / 2)
+
+    return split
+
+
+def polygon_generator(coords, cell_meters=500):
+    polygons_with_centroids, large_polygon = district_cells(coords, cell_meters)
+    min_lon, min_lat, max_lon, max_lat = large_polygon.bounds
 
     map_center = ((min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
     m = folium.Map(location=map_center, zoom_start=12)
@@ -146,6 +203,8 @@ def polygon_generator(coords):
 
 
 def scrape_data():
+    from async_scrape import scrape_cells_concurrently
+
     if "center" not in st.session_state:
         st.session_state["center"] = [35.71, 51.36]
     if "zoom" not in st.session_state:
@@ -162,79 +221,127 @@ def scrape_data():
     selected_category = selected['category']
 
     selected_district = select_district()
-    district = to_geojson(to_shape(selected_district.geom), indent=2)
+    district = to_geojson(selected_district.shape, indent=2)
     district = json.loads(district)
     st.write(f"Selected district: {selected_district.name}")
 
-    smaller_polygons, m = polygon_generator(district['coordinates'][0])
+    adaptive = st.toggle("Adaptive cells", help="Start from coarse cells and only split the ones whose results "
+                                                "look truncated. Fewer requests on sparse districts, better "
+                                                "recall on dense ones.")
+    cell_meters = ADAPTIVE_START_METERS if adaptive else 500
+    smaller_polygons, m = polygon_generator(district['coordinates'][0], cell_meters)
+    split = adaptive_splitter(Polygon([(lon, lat) for lat, lon in district['coordinates'][0]])) if adaptive else None
     fg = folium.FeatureGroup(name="Markers")
     # for marker in st.session_state["markers"]:
     #     fg.add_child(marker)
     st_folium(m, width=700, height=500, zoom=st.session_state.zoom, center=st.session_state.center, feature_group_to_add=fg)
 
-    base_url = "https://search.raah.ir/v4/bundle-search/"
     text = selected.get("slug", "No slug")
-    search_results = []
-    unique_entries = set()
+    col1, col2 = st.columns(2)
+    with col1:
+        concurrency = st.number_input("Concurrent requests:", 1, 32, 8)
+    with col2:
+        rate = st.number_input("Requests per second:", 0.5, 50.0, 5.0)
+    with col1:
+        refresh_hours = st.number_input("Skip cells scraped in the last (hours):", 0, 24 * 30, 24,
+                                        help="Interrupted scrapes resume from the cells not done yet.")
+    checkpoint = ScrapeCheckpoint(selected_district.id, text, refresh_after=refresh_hours * 3600)
+    with col2:
+        if st.button("Reset progress", disabled=not checkpoint.completed):
+            checkpoint.reset()
+    if checkpoint.completed:
+        st.caption(f"{len(checkpoint.completed)} cells of this district and subcategory already scraped.")
     if st.button("Scrape", type='primary'):
+        cache_before = response_cache.stats()
         session = db_handler()
         with st.status("Scraping Locations...", expanded=True) as status:
             progress_text = "Operation in progress. Please wait."
-            percent_complete = 0
-            sp_bar = st.progress(percent_complete, text=progress_text)
-            step = 1/len(smaller_polygons)
-            for poly in smaller_polygons:
-                camera = poly.get("centroid")
-                # polygon = poly.get("polygon")
-                # polygon_coords = [(lon, lat) for lon, lat in polygon.exterior.coords]
-                # polygon_param = "|".join(f"{lon},{lat}" for lon, lat in polygon_coords)
-                polygon_param = ''
-                bundle_data = fetch_bundle_search_data(base_url, text, polygon_param, selected_sub_category, camera)
-                features = bundle_data.get("geojson", {}).get("features", [])
-                poi_tokens = bundle_data.get("poi-tokens", [])
-                counter = 0
-                for feature in features:
-                    poi_token = poi_tokens[counter]
-                    counter += 1
-                    properties = feature.get("properties", {})
-                    geometry = feature.get("geometry", {})
-                    place_name = properties.get("name", "Unknown Place")
-                    rate = properties.get("rate")
-                    coordinates = tuple(geometry.get("coordinates", [None, None]))
-
-                    location = Location(
-                        name=place_name,
-                        geom=f"SRID=4326;POINT({coordinates[1]} {coordinates[0]})",
-                        rate=rate,
-                        token=poi_token,
-                        category=selected_category,
-                        subcategory=selected_sub_category,
-                    )
-                    marker = folium.CircleMarker(
-                        location=[coordinates[1], coordinates[0]],
-                        radius=3,
-                        color='red',
-                        fill=True,
-                        fill_color='blue'
-                    )
-                    st.session_state["markers"].append(marker)
-
-                    # fg.add_child(marker)
-
-                    location.add_to_db(session)
-
-                    if (place_name, coordinates) not in unique_entries:
-                        unique_entries.add((place_name, coordinates))
-                        search_results.append({
-                            "name": place_name,
-                            "coordinates": list(coordinates),
-                        })
-                percent_complete += step
-                sp_bar.progress(percent_complete, text=f":green[{len(search_results)}] locations found! {progress_text}")
+            sp_bar = st.progress(0, text=progress_text)
+
+            def update_progress(done, total, search_results):
+                sp_bar.progress(done / total, text=f":green[{len(search_results)}] locations found! {progress_text}")
+
+            if concurrency > 1:
+                search_results, stats = scrape_cells_concurrently(session, smaller_polygons, text, selected_category,
+                                                                  selected_sub_category, concurrency=concurrency,
+                                                                  rate=rate, progress=update_progress,
+                                                                  split=split, checkpoint=checkpoint)
+            else:
+                search_results, stats = scrape_cells(session, smaller_polygons, text, selected_category,
+                                                     selected_sub_category, progress=update_progress, split=split,
+                                                     checkpoint=checkpoint)
+            st.write(f":green[{stats['inserted']}] new locations stored, {stats['skipped']} already existed.")
 
         session.close()
         st.table(search_results)
         st.write(f"Number of unique results: {len(search_results)}")
+        cache_stats = response_cache.stats(since=cache_before)
+        st.caption(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses.")
+
+
+def scrape_cells(session, cells, slug, category, sub_category, base_url=BUNDLE_SEARCH_URL, progress=None, split=None,
+                 checkpoint=None):
+    """
+    Query the bundle search around every cell centroid and store the found locations in batches.
+
+    split, e.g. adaptive_splitter(...), is called as split(cell, bundle_data) after each response and
+    returns extra cells to query (the quadrants of a saturated cell). progress is called as
+    progress(done, total, search_results) after each cell, total growing as cells are split. With a
+    checkpoints.ScrapeCheckpoint, cells it reports as fresh are skipped, finished cells are recorded and
+    cached responses older than its refresh window (or its last reset) are fetched again.
+    Returns the list of unique {"name", "coordinates"} results and the {"inserted", "skipped"} database
+    counts.
+    """
+    search_results = []
+    cache_ttl = BUNDLE_SEARCH_CACHE_TTL
+    if checkpoint is not None:
+        cells = checkpoint.pending(cells)
+        cache_ttl = checkpoint.cache_ttl(cache_ttl)
+    queue = deque(cells)
+    done = 0
+    with LocationBatch(session) as batch:
+        collect = location_collector(batch, category, sub_category, search_results)
+        while queue:
+            poly = queue.popleft()
+            camera = poly.get("centroid")
+            # polygon = poly.get("polygon")
+            # polygon_coords = [(lon, lat) for lon, lat in polygon.exterior.coords]
+            # polygon_param = "|".join(f"{lon},{lat}" for lon, lat in polygon_coords)
+            polygon_param = ''
+            bundle_data = fetch_bundle_search_data(base_url, slug, polygon_param, sub_category, camera, cache_ttl)
+            collect(bundle_data)
+            children = split(poly, bundle_data) if split is not None else []
+            queue.extend(children)
+            if checkpoint is not None:
+                checkpoint.mark_done(poly, children, flush=batch.flush)
+            done += 1
+            if progress is not None:
+                progress(done, done + len(queue), search_results)
+    if checkpoint is not None:
+        checkpoint.save()
+    return search_results, {"inserted": batch.inserted, "skipped": batch.skipped}
+
+
+def location_collector(batch, category, sub_category, search_results):
+    """Returns a function storing the places of one bundle search response and appending new unique results."""
+    unique_entries = set()
 
-
-
+    def collect(bundle_data):
+        for poi_token, place_name, rate, coordinates in parse_bundle_features(bundle_data):
+            batch.add(
+                name=place_name,
+                geom=f"SRID=4326;POINT({coordinates[1]} {coordinates[0]})",
+                rate=rate,
+                token=poi_token,
+                category=category,
+                subcategory=sub_category,
+            )
+
+            if (place_name, coordinates) not in unique_entries:
+                unique_entries.add((place_name, coordinates))
+                search_results.append({
+                    "name": place_name,
+                    "coordinates": list(coordinates),
+                })
+
+    return collect
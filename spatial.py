@@ -0,0 +1,120 @@
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+
+
+def build_grid(bounds, grid_size=0.001):
+    """Build the candidate grid covering the given (min_lat, min_lon, max_lat, max_lon) bounds."""
+    min_lat, min_lon, max_lat, max_lon = bounds
+    lat_points = np.arange(min_lat, max_lat, grid_size)
+    lon_points = np.arange(min_lon, max_lon, grid_size)
+    lat_grid, lon_grid = np.meshgrid(lat_points, lon_points)
+    grid_coords = np.column_stack([lat_grid.ravel(), lon_grid.ravel()])
+    return grid_coords
+
+
+def banned_mask_geometry(banned_polys):
+    """Union all banned zones into a single prepared geometry (or None when there are none)."""
+    if not banned_polys:
+        return None
+    banned = shapely.union_all(banned_polys)
+    shapely.prepare(banned)
+    return banned
+
+
+def grid_mask(grid_coords, district_polygon, banned_polys):
+    """
+    Boolean mask of the grid points that lie inside the district and outside every banned zone.
+
+    Point-in-polygon is evaluated for the whole grid at once against prepared geometries,
+    instead of building a shapely Point per cell.
+    """
+    district_polygon = Polygon(district_polygon)
+    shapely.prepare(district_polygon)
+    lat, lon = grid_coords[:, 0], grid_coords[:, 1]
+    mask = shapely.contains_xy(district_polygon, lat, lon)
+
+    banned = banned_mask_geometry(banned_polys)
+    if banned is not None and mask.any():
+        mask[mask] = ~shapely.contains_xy(banned, lat[mask], lon[mask])
+    return mask
+
+
+def buffer_mask(candidates, coords, buffer_distance):
+    """
+    Boolean mask of the candidates whose nearest existing business is at least buffer_distance away.
+
+    Uses a single bulk nearest-neighbour query against a KD-tree of the business coordinates
+    (same euclidean distance in degrees as the previous cdist scan).
+    """
+    from scipy.spatial import cKDTree
+
+    if len(candidates) == 0:
+        return np.zeros(0, dtype=bool)
+    distances, _ = cKDTree(coords).query(candidates, k=1)
+    return distances >= buffer_distance
+
+
+def low_density_candidates(density, grid_coords, coords, percentile, buffer_distance):
+    """
+    Candidate locations below the density percentile and outside the buffer around existing businesses.
+
+    Returns (locations, weights) with weights rescaled so the emptiest candidate scores 1, or
+    (None, None) when no candidate is left.
+    """
+    # Filter low-density areas
+    low_density_threshold = np.percentile(density[density >= 0], percentile)  # Adjust threshold as needed
+    low_density_mask = density < low_density_threshold
+
+    low_density_locations = grid_coords[low_density_mask]
+
+    # Filter suggested locations with a buffer zone around existing businesses
+    # buffer_distance = 0.005  # Approx ~500 meters, adjust as needed
+    buffer_filter = buffer_mask(low_density_locations, coords, buffer_distance)
+    filtered_locations = low_density_locations[buffer_filter]
+
+    # Prepare heatmap data with density as weights
+    filtered_density = density[low_density_mask][buffer_filter]  # Match density with filtered locations
+
+    if len(filtered_locations) == 0:
+        return None, None
+    # Normalize weights
+    weights = ((filtered_density - filtered_density.min()) / (filtered_density.max() - filtered_density.min()))
+    weights = 1 - weights
+    return filtered_locations, weights
+
+
+def group_peaks(labels, weights):
+    """
+    Index of the highest-weight point of every cluster label (the first point on ties), ignoring the
+    -1 noise label, ordered by the first appearance of each label. A single lexsort instead of grouping
+    the points into per-cluster lists.
+    """
+    labels = np.asarray(labels)
+    weights = np.asarray(weights, dtype=float)
+    if len(labels) == 0:
+        return np.empty(0, dtype=np.intp)
+    order = np.lexsort((np.arange(len(labels)), -weights, labels))
+    sorted_labels = labels[order]
+    starts = np.r_[True, sorted_labels[1:] != sorted_labels[:-1]]
+    peaks, peak_labels = order[starts], sorted_labels[starts]
+    _, first_seen = np.unique(labels, return_index=True)  # sorted by label, like peak_labels
+    keep = peak_labels != -1
+    return peaks[keep][np.argsort(first_seen[keep], kind="stable")]
+
+
+def grid_components(points, grid_size=0.001):
+    """
+    Cluster label of each point on the regular grid: points in 8-connected neighbouring cells share a
+    label (connected components of the occupied cells), so no distance computation is needed.
+    """
+    from scipy import ndimage
+
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) == 0:
+        return np.empty(0, dtype=np.intp)
+    cells = np.rint((points - points.min(axis=0)) / grid_size).astype(np.intp)
+    occupied = np.zeros(cells.max(axis=0) + 1, dtype=bool)
+    occupied[cells[:, 0], cells[:, 1]] = True
+    components, _ = ndimage.label(occupied, structure=np.ones((3, 3), dtype=bool))
+    return components[cells[:, 0], cells[:, 1]] - 1
@@ -11,7 +11,6 @@ from folium.plugins import HeatMap
 from dbhandler import db_handler
 from districts import District
 from geopy.distance import geodesic
-from heatmaps import HeatMap
 
 # Database connection
 session = db_handler()
@@ -0,0 +1,107 @@
+import os
+import sys
+
+# The app modules live flat at the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+# Empty PostGIS database the database tests may use; they are skipped when it is not set. Everything they
+# write is rolled back.
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def db_session():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import Session
+
+    from dbhandler import Base
+    import migrate  # noqa: F401 (registers every table)
+
+    engine = create_engine(TEST_DATABASE_URL)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS postgis"))
+    Base.metadata.create_all(engine)
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        # Commits inside the code under test only release savepoints of this outer transaction
+        session = Session(bind=connection, join_transaction_mode="create_savepoint")
+        try:
+            yield session
+        finally:
+            session.close()
+            transaction.rollback()
+    engine.dispose()
+
+
+class FakeQuery:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *criteria):
+        return self
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeSession:
+    """
+    Session stand-in for the tests that need no database. calls records "flush", "execute", "commit" and
+    "rollback" in order and added the added objects, which flush numbers from 1. execute answers with
+    `returning` as (id,) rows and raises on its fail_on-th call; query yields the added (id, surface) pairs.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.added = []
+        self.statements = []
+        self.returning = []
+        self.fail_on = None
+
+    @property
+    def commits(self):
+        return self.calls.count("commit")
+
+    def add(self, instance):
+        self.added.append(instance)
+
+    def add_all(self, instances):
+        self.added.extend(instances)
+
+    def flush(self):
+        self.calls.append("flush")
+        for instance_id, instance in enumerate(self.added, start=1):
+            instance.id = instance_id
+
+    def execute(self, statement, parameters=None):
+        self.calls.append("execute")
+        self.statements.append(statement)
+        if self.calls.count("execute") == self.fail_on:
+            raise RuntimeError("connection lost")
+        return FakeResult([(instance_id,) for instance_id in self.returning])
+
+    def query(self, *columns):
+        return FakeQuery([(instance.id, instance.surface) for instance in self.added])
+
+    def commit(self):
+        self.calls.append("commit")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+
+@pytest.fixture
+def fake_session():
+    return FakeSession()
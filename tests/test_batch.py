@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import batch
+from heatmaps import Heatmap, HeatmapPoint
+
+
+def fake_surface(task):
+    """Worker stand-in: a one-cell surface per subcategory, failing for the "broken" one."""
+    category, subcategory = task[:2]
+    if subcategory == "broken":
+        raise RuntimeError("invalid geometry")
+    return {"category": category, "subcategory": subcategory, "businesses": 3, "status": "ok",
+            "locations": np.array([[35.7, 51.4], [35.701, 51.4]]), "weights": np.array([0.5, 1.0]),
+            "kde_info": {"engine": "binned", "bandwidth": 0.1, "grid_size": 0.001, "seconds": 0.0}}
+
+
+@pytest.fixture
+def session(monkeypatch, fake_session):
+    monkeypatch.setattr(batch, "fetch_district_inputs", lambda session, district_id: (None, []))
+    monkeypatch.setattr(batch, "_generate_surface", fake_surface)
+    superseded = []
+    monkeypatch.setattr(Heatmap, "supersede", lambda self, session: superseded.append(self.subcategory))
+    monkeypatch.setattr(HeatmapPoint, "explode", classmethod(lambda cls, session, heatmap_ids: None))
+    fake_session.superseded = superseded
+    return fake_session
+
+
+def test_failing_subcategory_keeps_the_others(session):
+    results = batch.generate_heatmaps_batch(session, 1, [("food", "cafe"), ("food", "broken"), ("shop", "bakery")],
+                                            0.005, 50, workers=2)
+    statuses = {result["subcategory"]: result["status"] for result in results}
+    assert statuses == {"cafe": "ok", "broken": "error", "bakery": "ok"}
+    assert next(result for result in results if result["status"] == "error")["error"] == "invalid geometry"
+    assert sorted(heatmap.subcategory for heatmap in session.added) == ["bakery", "cafe"]
+    assert session.commits == 1
+
+
+def test_duplicate_subcategories_are_generated_once(session):
+    results = batch.generate_heatmaps_batch(session, 1, [("food", "cafe"), ("drinks", "cafe")], 0.005, 50, workers=1)
+    assert sorted(result["status"] for result in results) == ["duplicate", "ok"]
+    assert session.superseded == ["cafe"]
+    assert [(heatmap.category, heatmap.subcategory) for heatmap in session.added] == [("food", "cafe")]
+
+
+def test_failed_explode_commits_nothing(session, monkeypatch):
+    def explode(cls, session, heatmap_ids):
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(HeatmapPoint, "explode", classmethod(explode))
+    with pytest.raises(RuntimeError):
+        batch.generate_heatmaps_batch(session, 1, [("food", "cafe")], 0.005, 50, workers=1)
+    assert session.commits == 0
+
+
+def tree_surface(task):
+    """Worker stand-in that records the engine and tree settings it was given, like district_density does."""
+    result = fake_surface(task)
+    result["kde_info"] = {**result["kde_info"], "engine": task[6], **task[7]}
+    return result
+
+
+def test_kde_params_reach_the_workers(session, monkeypatch):
+    monkeypatch.setattr(batch, "_generate_surface", tree_surface)
+    batch.generate_heatmaps_batch(session, 1, [("food", "cafe")], 0.005, 50, "exact", workers=1,
+                                  kde_params={"algorithm": "ball_tree", "rtol": 1e-6})
+    heatmap, = session.added
+    assert heatmap.kde_engine == "exact"
+    assert (heatmap.kde_params["algorithm"], heatmap.kde_params["rtol"]) == ("ball_tree", 1e-6)
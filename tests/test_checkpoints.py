@@ -0,0 +1,74 @@
+import time
+
+from checkpoints import ScrapeCheckpoint, cell_key
+from scrape import adaptive_splitter, district_cells
+
+DISTRICT = [(35.700, 51.400), (35.700, 51.416), (35.714, 51.416), (35.714, 51.400), (35.700, 51.400)]
+
+
+def test_completed_cells_are_skipped_after_reload(tmp_path):
+    cells, _ = district_cells(DISTRICT)
+    checkpoint = ScrapeCheckpoint(7, "restaurant", directory=tmp_path)
+    for cell in cells[:3]:
+        checkpoint.mark_done(cell)
+    checkpoint.save()
+
+    resumed = ScrapeCheckpoint(7, "restaurant", directory=tmp_path)
+    assert [cell_key(cell) for cell in resumed.pending(cells)] == [cell_key(cell) for cell in cells[3:]]
+    # Another district or slug has its own checkpoint
+    assert len(ScrapeCheckpoint(7, "cafe", directory=tmp_path).pending(cells)) == len(cells)
+
+
+def test_refresh_after(tmp_path):
+    cells, _ = district_cells(DISTRICT)
+    checkpoint = ScrapeCheckpoint(7, "restaurant", refresh_after=3600, directory=tmp_path)
+    checkpoint.mark_done(cells[0])
+    checkpoint.mark_done(cells[1])
+    checkpoint.completed[cell_key(cells[1])] = time.time() - 7200
+    pending = {cell_key(cell) for cell in checkpoint.pending(cells)}
+    assert cell_key(cells[0]) not in pending and cell_key(cells[1]) in pending
+
+
+def test_queued_quadrants_survive_a_restart(tmp_path):
+    cells, large_polygon = district_cells(DISTRICT, 1000)
+    children = adaptive_splitter(large_polygon, result_cap=1, min_meters=125)(cells[0], {"geojson": {"features": [{}]}})
+    checkpoint = ScrapeCheckpoint(7, "restaurant", directory=tmp_path)
+    checkpoint.mark_done(cells[0], children)
+    checkpoint.save()
+
+    pending = ScrapeCheckpoint(7, "restaurant", directory=tmp_path).pending(cells)
+    assert {cell_key(cell) for cell in pending} == {cell_key(cell) for cell in cells[1:] + children}
+    restored = next(cell for cell in pending if cell_key(cell) == cell_key(children[0]))
+    assert restored["meters"] == children[0]["meters"]
+    assert restored["polygon"].equals(children[0]["polygon"])
+
+
+def test_save_every_flushes_first(tmp_path):
+    cells, _ = district_cells(DISTRICT)
+    flushed = []
+    checkpoint = ScrapeCheckpoint(7, "restaurant", directory=tmp_path, save_every=2)
+    checkpoint.mark_done(cells[0], flush=lambda: flushed.append(1))
+    assert not checkpoint.path.exists() and not flushed
+    checkpoint.mark_done(cells[1], flush=lambda: flushed.append(2))
+    assert checkpoint.path.exists() and flushed == [2]
+
+
+def test_reset(tmp_path):
+    cells, _ = district_cells(DISTRICT)
+    checkpoint = ScrapeCheckpoint(7, "restaurant", directory=tmp_path)
+    checkpoint.mark_done(cells[0])
+    checkpoint.save()
+    checkpoint.reset()
+    reloaded = ScrapeCheckpoint(7, "restaurant", directory=tmp_path)
+    assert len(reloaded.pending(cells)) == len(cells)
+    assert reloaded.reset_at == checkpoint.reset_at
+
+
+def test_cache_ttl(tmp_path):
+    checkpoint = ScrapeCheckpoint(7, "restaurant", directory=tmp_path)
+    assert checkpoint.cache_ttl(43200) == 43200
+    # A cell due for refresh after an hour must not be answered from an older cached response
+    assert ScrapeCheckpoint(7, "restaurant", refresh_after=3600, directory=tmp_path).cache_ttl(43200) == 3600
+    # Nothing cached before a reset is reused, even after reloading the checkpoint
+    checkpoint.reset()
+    assert ScrapeCheckpoint(7, "restaurant", refresh_after=3600, directory=tmp_path).cache_ttl(43200) < 5
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from shapely.geometry import box
+
+from density import MIN_USEFUL_RTOL, auto_tree_params, district_density, estimate_density
+from spatial import build_grid
+
+BOUNDS = (35.68, 51.30, 35.80, 51.42)
+
+
+def normalized(density):
+    return (density - density.min()) / (density.max() - density.min())
+
+
+@pytest.fixture(scope="module")
+def businesses():
+    rng = np.random.default_rng(0)
+    return np.c_[35.68 + rng.random(300) * 0.12, 51.30 + rng.random(300) * 0.12]
+
+
+def test_binned_density_matches_exact(businesses):
+    grid_coords = build_grid(BOUNDS, 0.002)
+    exact, _ = estimate_density(businesses, grid_coords, "exact", 0.002)
+    binned, info = estimate_density(businesses, grid_coords, "binned", 0.002)
+    assert info["engine"] == "binned"
+    np.testing.assert_allclose(binned, exact, rtol=1e-6)
+    assert np.abs(normalized(binned) - normalized(exact)).max() < 2e-3
+
+
+def test_district_density_is_normalized_and_masked(businesses):
+    district = box(35.70, 51.32, 35.78, 51.40)
+    banned = [box(35.72, 51.34, 35.74, 51.36)]
+    density, grid_coords, info = district_density(businesses, district, banned, "binned", 0.002)
+    assert density.min() == 0 and density.max() == 1
+    assert len(density) == len(grid_coords)
+    inside_banned = ((grid_coords[:, 0] > 35.72) & (grid_coords[:, 0] < 35.74)
+                     & (grid_coords[:, 1] > 51.34) & (grid_coords[:, 1] < 51.36))
+    assert not inside_banned.any()
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        estimate_density(np.array([[35.7, 51.4]]), np.array([[35.7, 51.4]]), "nearest")
+
+
+def test_exact_engine_records_tree_settings(businesses):
+    grid_coords = build_grid(BOUNDS, 0.004)
+    default, info = estimate_density(businesses, grid_coords, "exact")
+    assert (info["algorithm"], info["atol"], info["rtol"]) == ("auto", 0, 0)
+    assert info["seconds"] >= 0 and info["bandwidth"] > 0
+
+    tuned, info = estimate_density(businesses, grid_coords, "exact", kde_params={"algorithm": "ball_tree", "rtol": 1e-12})
+    assert (info["algorithm"], info["rtol"]) == ("ball_tree", 1e-12)
+    np.testing.assert_allclose(tuned, default, rtol=1e-9)
+
+
+def test_auto_tree_params():
+    # Small problems, and a bandwidth much wider than the district, stay exact
+    assert auto_tree_params(300, 1000, 0.26, 0.002)["rtol"] == 0
+    assert auto_tree_params(30000, 20000, 0.26, 0.002)["rtol"] == 0
+    params = auto_tree_params(30000, 20000, 0.01, 0.02)
+    assert params["algorithm"] == "ball_tree" and params["leaf_size"] == 100
+    assert MIN_USEFUL_RTOL <= params["rtol"] <= 1e-3
+
+
+def test_approximate_engine_records_its_policy(businesses):
+    grid_coords = build_grid(BOUNDS, 0.004)
+    exact, _ = estimate_density(businesses, grid_coords, "exact")
+    approximate, info = estimate_density(businesses, grid_coords, "approximate")
+    assert (info["engine"], info["algorithm"], info["rtol"]) == ("approximate", "ball_tree", 0)
+    np.testing.assert_allclose(approximate, exact, rtol=1e-9)
+
+    _, info = estimate_density(businesses, grid_coords, "approximate", kde_params={"leaf_size": 10})
+    assert info["leaf_size"] == 10
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from districts import District
+from heatmaps import Heatmap, HeatmapPoint
+
+LOCATIONS = np.array([[35.700, 51.400], [35.701, 51.400], [35.701, 51.401]])
+
+
+@pytest.fixture
+def district(db_session):
+    district = District(name="test district",
+                        geom="SRID=4326;POLYGON((35.69 51.39, 35.71 51.39, 35.71 51.41, 35.69 51.41, 35.69 51.39))")
+    db_session.add(district)
+    db_session.flush()
+    return district
+
+
+def add_heatmap(session, district, subcategory="cafe", percentile=50):
+    heatmap = Heatmap(district_id=district.id, category="food", subcategory=subcategory, percentile=percentile)
+    heatmap.set_surface(LOCATIONS, [0.2, 0.6, 1.0], 0.001)
+    heatmap.add_to_db(session)
+    assert heatmap.id is not None
+    return heatmap
+
+
+def point_count(session, heatmap):
+    return session.query(HeatmapPoint).filter(HeatmapPoint.heatmap_id == heatmap.id).count()
+
+
+def test_supersede_keeps_one_current_heat_map(db_session, district):
+    first = add_heatmap(db_session, district)
+    second = add_heatmap(db_session, district)
+    other = add_heatmap(db_session, district, subcategory="bakery")
+    other_percentile = add_heatmap(db_session, district, percentile=90)
+    for heatmap in (first, second, other, other_percentile):
+        db_session.refresh(heatmap)
+    assert (first.is_current, second.is_current, other.is_current, other_percentile.is_current) == \
+           (False, True, True, True)
+    assert point_count(db_session, second) == len(LOCATIONS)
+
+
+def test_unique_current_index(db_session, district):
+    add_heatmap(db_session, district)
+    duplicate = Heatmap(district_id=district.id, subcategory="cafe", percentile=50, is_current=True)
+    db_session.add(duplicate)
+    with pytest.raises(IntegrityError):
+        db_session.flush()
+
+
+def test_apply_retention(db_session, district):
+    _, older, current = (add_heatmap(db_session, district) for _ in range(3))
+    deleted, compacted = Heatmap.apply_retention(db_session, keep=1)
+    assert deleted == 1
+    assert compacted == len(LOCATIONS)  # the points of the kept superseded heat map
+    ids = {heatmap_id for heatmap_id, in db_session.query(Heatmap.id).filter(Heatmap.district_id == district.id)}
+    assert ids == {older.id, current.id}
+    assert point_count(db_session, older) == 0
+    assert point_count(db_session, current) == len(LOCATIONS)
+
+
+def test_refresh_current(db_session, district):
+    first, second = add_heatmap(db_session, district), add_heatmap(db_session, district)
+    db_session.query(Heatmap).filter(Heatmap.id.in_([first.id, second.id])).update(
+        {Heatmap.is_current: None}, synchronize_session=False)
+    Heatmap.refresh_current(db_session)
+    db_session.refresh(first)
+    db_session.refresh(second)
+    assert (first.is_current, second.is_current) == (False, True)
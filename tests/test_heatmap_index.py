@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from scipy.spatial.distance import cdist
+
+import business_suggestion
+from heatmap_index import HeatmapIndex, MAX_SUGGESTION_DISTANCE
+
+
+def fake_heatmap(heatmap_id, subcategory, points, weights, kde_engine="binned"):
+    points, weights = np.asarray(points, dtype=float), np.asarray(weights, dtype=float)
+    return SimpleNamespace(id=heatmap_id, subcategory=subcategory, kde_engine=kde_engine,
+                           surface_arrays=lambda: (points, weights))
+
+
+def scan(selected_location, heatmaps):
+    """The linear scan evaluate_business_potential used before the index."""
+    results = {}
+    for heatmap in heatmaps:
+        points, weights = heatmap.surface_arrays()
+        distances = np.linalg.norm(points - selected_location, axis=1)
+        closest_point_index = np.argmin(distances)
+        closest_point_density = weights[closest_point_index]
+        distance = cdist([selected_location.tolist()], [points[closest_point_index].tolist()], metric='euclidean')
+        if distance > MAX_SUGGESTION_DISTANCE:
+            continue
+        if heatmap.subcategory not in results or results[heatmap.subcategory][0] < closest_point_density:
+            results[heatmap.subcategory] = [closest_point_density, points[closest_point_index], heatmap.id,
+                                            heatmap.kde_engine]
+    return results
+
+
+@pytest.fixture(scope="module")
+def heatmaps():
+    rng = np.random.default_rng(3)
+    # Two heat maps share a subcategory, so the per-subcategory max matters
+    return [fake_heatmap(heatmap_id, subcategory, 35.7 + rng.random((400, 2)) * 0.02, rng.random(400))
+            for heatmap_id, subcategory in enumerate(["cafe", "bakery", "cafe", "gym"], start=1)]
+
+
+def assert_same(results, expected):
+    assert results.keys() == expected.keys()
+    for subcategory, (density, point, heatmap_id, engine) in expected.items():
+        assert results[subcategory][0] == density
+        np.testing.assert_array_equal(results[subcategory][1], point)
+        assert results[subcategory][2:] == [heatmap_id, engine]
+
+
+def test_evaluate_matches_linear_scan(heatmaps):
+    index = HeatmapIndex(heatmaps)
+    rng = np.random.default_rng(4)
+    for location in 35.7 + rng.random((300, 2)) * 0.02:
+        assert_same(index.evaluate(location), scan(location, heatmaps))
+
+
+def test_point_exactly_at_the_cutoff_counts():
+    location = np.array([0.0, 0.0])
+    heatmaps = [fake_heatmap(1, "cafe", [[MAX_SUGGESTION_DISTANCE, 0.0]], [0.4]),
+                fake_heatmap(2, "gym", [[np.nextafter(MAX_SUGGESTION_DISTANCE, 1), 0.0]], [0.9])]
+    expected = scan(location, heatmaps)
+    assert list(expected) == ["cafe"]
+    assert_same(HeatmapIndex(heatmaps).evaluate(location), expected)
+
+
+def test_evaluate_many_matches_evaluate(heatmaps):
+    index = HeatmapIndex(heatmaps)
+    locations = 35.7 + np.random.default_rng(5).random((300, 2)) * 0.02
+    subcategories, densities, heatmap_ids = index.evaluate_many(locations)
+    for row, location in enumerate(locations):
+        expected = index.evaluate(location)
+        for column, subcategory in enumerate(subcategories):
+            if subcategory in expected:
+                assert (densities[row, column], heatmap_ids[row, column]) == tuple(expected[subcategory][0:3:2])
+            else:
+                assert np.isnan(densities[row, column]) and heatmap_ids[row, column] == -1
+
+
+def test_score_locations_ranks_filters_and_drops_uncovered(monkeypatch):
+    heatmaps = [fake_heatmap(1, "cafe", [[35.700, 51.400], [35.710, 51.410]], [0.2, 0.9]),
+                fake_heatmap(2, "gym", [[35.700, 51.400], [35.710, 51.410]], [0.7, 0.1]),
+                fake_heatmap(3, "bakery", [[35.700, 51.400]], [0.5])]
+    monkeypatch.setattr(business_suggestion, "load_heatmap_index", lambda district_id: HeatmapIndex(heatmaps))
+    locations = [[35.700, 51.400], [35.750, 51.450], [35.710, 51.410]]
+
+    table = business_suggestion.score_locations(locations, 1)
+    assert table["location"].tolist() == [0, 0, 0, 2, 2]  # The second location is outside every heat map
+    assert table["subcategory"].tolist() == ["gym", "bakery", "cafe", "cafe", "gym"]
+    assert table["rank"].tolist() == [1, 2, 3, 1, 2]
+    assert table["heatmap_id"].tolist() == [2, 3, 1, 1, 2]
+    assert table[["lat", "lon"]].iloc[3].tolist() == [35.710, 51.410]
+
+    top = business_suggestion.score_locations(locations, 1, top=1)
+    assert top[["location", "subcategory"]].values.tolist() == [[0, "gym"], [2, "cafe"]]
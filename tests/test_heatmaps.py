@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from heatmaps import Heatmap, HeatmapPoint
+from raster import encode_surface
+
+LOCATIONS = np.array([[35.700, 51.400], [35.701, 51.400], [35.701, 51.401]])
+WEIGHTS = np.array([0.25, 0.5, 1.0])
+
+
+@pytest.fixture
+def heatmap(monkeypatch):
+    monkeypatch.setattr(Heatmap, "supersede", lambda self, session: setattr(self, "is_current", True))
+    heatmap = Heatmap(district_id=1, subcategory="cafe", percentile=50)
+    heatmap.surface = encode_surface(LOCATIONS, WEIGHTS, 0.001)
+    return heatmap
+
+
+def test_points_are_written_before_the_commit(heatmap, fake_session):
+    heatmap.add_to_db(fake_session)
+    # Multipoint explode, then the bulk insert of the decoded raster points, then the commit
+    assert fake_session.calls == ["flush", "execute", "execute", "commit"]
+
+
+def test_failed_explode_does_not_commit_the_heat_map(heatmap, fake_session):
+    fake_session.fail_on = 2
+    heatmap.add_to_db(fake_session)
+    assert "commit" not in fake_session.calls and fake_session.calls[-1] == "rollback"
+
+
+def test_explode_lets_errors_propagate(heatmap, fake_session):
+    fake_session.fail_on = 1
+    with pytest.raises(RuntimeError):
+        HeatmapPoint.explode(fake_session, [1])
+    assert "commit" not in fake_session.calls
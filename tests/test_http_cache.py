@@ -0,0 +1,87 @@
+import os
+import time
+
+from http_cache import ResponseCache, cached_get_json
+
+URL = "https://example.invalid/v4/bundle-search/"
+
+
+def entry_size(cache, params):
+    return cache.path(cache.key(URL, params)).stat().st_size
+
+
+def test_round_trip_and_expiry(tmp_path):
+    cache = ResponseCache(tmp_path, ttl=60)
+    assert cache.get(URL, {"text": "cafe"}) is None
+    cache.put(URL, {"text": "cafe"}, {"places": ["کافه"]})
+    assert cache.get(URL, {"text": "cafe"}) == {"places": ["کافه"]}
+    assert cache.get(URL, {"text": "bakery"}) is None
+    assert cache.stats() == {"hits": 1, "misses": 2}
+
+    path = cache.path(cache.key(URL, {"text": "cafe"}))
+    os.utime(path, (time.time(), time.time() - 120))
+    assert cache.get(URL, {"text": "cafe"}) is None
+    assert cache.get(URL, {"text": "cafe"}, ttl=600) is not None
+
+
+def test_stats_since(tmp_path):
+    cache = ResponseCache(tmp_path)
+    cache.get(URL, {"text": "cafe"})
+    before = cache.stats()
+    cache.put(URL, {"text": "cafe"}, {})
+    cache.get(URL, {"text": "cafe"})
+    cache.get(URL, {"text": "bakery"})
+    assert cache.stats(since=before) == {"hits": 1, "misses": 1}
+
+
+def test_overwrite_does_not_grow_the_size(tmp_path):
+    cache = ResponseCache(tmp_path)
+    cache.put(URL, {"text": "cafe"}, {"places": list(range(100))})
+    cache.put(URL, {"text": "bakery"}, {"places": []})
+    for _ in range(5):
+        cache.put(URL, {"text": "cafe"}, {"places": list(range(100))})
+    assert cache.size == entry_size(cache, {"text": "cafe"}) + entry_size(cache, {"text": "bakery"})
+
+
+def test_least_recently_read_entries_are_evicted(tmp_path):
+    payload = {"places": [str(i) * 20 for i in range(200)]}
+    cache = ResponseCache(tmp_path, max_bytes=10 ** 9)
+    cache.put(URL, {"text": "0"}, payload)
+    size = entry_size(cache, {"text": "0"})
+    cache.max_bytes = size * 3.5
+    for index in range(1, 3):
+        cache.put(URL, {"text": str(index)}, payload)
+    # Read order 1, 0, 2: entry 1 is the least recently read
+    for index, read_at in ((1, 100), (0, 200), (2, 300)):
+        path = cache.path(cache.key(URL, {"text": str(index)}))
+        os.utime(path, (time.time() - 1000 + read_at, path.stat().st_mtime))
+    cache.put(URL, {"text": "3"}, payload)
+
+    assert cache.size <= cache.max_bytes * 0.9
+    kept = {index for index in range(4) if cache.path(cache.key(URL, {"text": str(index)})).exists()}
+    assert 1 not in kept and 3 in kept
+    assert len(kept) == 3
+
+
+def test_cached_get_json_skips_failed_responses(tmp_path):
+    class Response:
+        def __init__(self, status_code, payload=None):
+            self.status_code = status_code
+            self.payload = payload
+
+        def json(self):
+            return self.payload
+
+    class Http:
+        def __init__(self, responses):
+            self.responses = responses
+
+        def get(self, url, params=None):
+            return self.responses.pop(0)
+
+    cache = ResponseCache(tmp_path)
+    http = Http([Response(503), Response(200, {"ok": True})])
+    assert cached_get_json(URL, {"text": "cafe"}, session=http, cache=cache) == {}
+    assert cached_get_json(URL, {"text": "cafe"}, session=http, cache=cache) == {"ok": True}
+    assert cached_get_json(URL, {"text": "cafe"}, session=http, cache=cache) == {"ok": True}
+    assert http.responses == []
@@ -0,0 +1,12 @@
+import pytest
+
+from benchmarks.import_time import BUDGET, profile
+
+
+@pytest.mark.parametrize("module", sorted(BUDGET))
+def test_module_imports_without_database_and_heavy_libraries(module):
+    # Imported in a fresh interpreter with DATABASE_URL pointing at a closed port
+    report, error = profile(module)
+    assert report is not None, f"{module} fails to import without a database: {' '.join(error)}"
+    loaded = [name for name in BUDGET[module] if name in report["loaded"]]
+    assert not loaded, f"{module} loads {', '.join(loaded)} at import time"
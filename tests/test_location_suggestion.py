@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+import folium
+import numpy as np
+from shapely.geometry import box
+
+from location_suggestion import build_base_map
+
+
+def polygons(city_map):
+    """Every folium Polygon of the map, at any depth."""
+    found = []
+    children = list(city_map._children.values())
+    while children:
+        child = children.pop()
+        if isinstance(child, folium.Polygon):
+            found.append(child)
+        children.extend(child._children.values())
+    return found
+
+
+def test_base_map_draws_the_fetched_banned_zones():
+    shape = box(35.70, 51.30, 35.80, 51.40)
+    district = SimpleNamespace(name="1", shape=shape, display_ring=lambda: [list(xy) for xy in shape.exterior.coords])
+    banned = box(35.72, 51.32, 35.74, 51.34)
+    city_map = build_base_map(district, np.array([[35.75, 51.35]]), np.array(["Cafe"]), np.array(["Park"]),
+                              [banned], "geojson")
+
+    zone, = [polygon for polygon in polygons(city_map) if polygon.options.get("color") == "red"]
+    assert set(map(tuple, zone.locations)) == set(banned.exterior.coords)
+    tooltip, = [child for child in zone._children.values() if isinstance(child, folium.Tooltip)]
+    assert tooltip.text == "BannedDistrict: Park"
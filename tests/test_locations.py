@@ -0,0 +1,18 @@
+import locations
+from locations import Location
+
+
+def test_add_to_db_goes_through_bulk_add_and_bumps_data_versions(monkeypatch, fake_session):
+    bumped = []
+    monkeypatch.setattr(locations.DataVersion, "bump_for_locations",
+                        classmethod(lambda cls, session, ids: bumped.append(ids)))
+    location = Location(name="Cafe", token="abc", geom="SRID=4326;POINT(35.7 51.4)", subcategory="cafe")
+
+    fake_session.returning = [7]
+    assert location.add_to_db(fake_session) is True
+    assert bumped == [[7]] and fake_session.commits == 1
+    columns = {name.rsplit("_m", 1)[0]: value for name, value in fake_session.statements[0].compile().params.items()}
+    assert columns["token"] == "abc" and columns["subcategory"] == "cafe" and "id" not in columns
+
+    fake_session.returning = []
+    assert location.add_to_db(fake_session) is False  # Token already stored
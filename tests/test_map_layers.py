@@ -0,0 +1,47 @@
+import base64
+import io
+
+import folium
+import numpy as np
+from PIL import Image
+
+from map_layers import add_business_layer, colorize, point_features, surface_overlay
+
+
+def test_point_features_are_lon_lat():
+    collection = point_features([[35.7001234567, 51.4]], {"name": ["Cafe"]})
+    feature, = collection["features"]
+    assert feature["geometry"] == {"type": "Point", "coordinates": [51.4, 35.700123]}
+    assert feature["properties"] == {"name": "Cafe"}
+
+
+def test_business_layer_geojson_and_markers_agree():
+    locations, names = np.array([[35.70, 51.40], [35.71, 51.42]]), ["Cafe", "Bakery"]
+
+    layer, = add_business_layer(folium.FeatureGroup(), locations, names, "geojson")._children.values()
+    assert [feature["geometry"]["coordinates"] for feature in layer.data["features"]] == [[51.40, 35.70], [51.42, 35.71]]
+    assert [feature["properties"]["name"] for feature in layer.data["features"]] == names
+
+    markers = list(add_business_layer(folium.FeatureGroup(), locations, names, "markers")._children.values())
+    assert [marker.location for marker in markers] == [[35.70, 51.40], [35.71, 51.42]]
+    popup, = [child for child in markers[1]._children.values() if isinstance(child, folium.Popup)]
+    html, = popup.html._children.values()
+    assert html.data == "<b>Bakery</b>"
+
+
+def test_surface_overlay_bounds_and_north_up():
+    grid_size = 0.001
+    # 3 latitude rows by 5 longitude columns, strongest in the north-east corner
+    lat, lon = np.meshgrid(35.700 + np.arange(3) * grid_size, 51.400 + np.arange(5) * grid_size, indexing="ij")
+    locations = np.c_[lat.ravel(), lon.ravel()]
+    weights = np.linspace(0, 1, len(locations))
+    url, bounds = surface_overlay(locations, weights, grid_size)
+
+    # Pixel edges: half a cell beyond the outermost cell centres
+    np.testing.assert_allclose(bounds, [[35.700 - grid_size / 2, 51.400 - grid_size / 2],
+                                        [35.702 + grid_size / 2, 51.404 + grid_size / 2]])
+    image = np.asarray(Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))).convert("RGBA"))
+    assert image.shape == (3, 5, 4)
+    row, column = np.unravel_index(np.argmax(image[..., 3]), image.shape[:2])
+    assert (row, column) == (0, 4)  # The northernmost row is the first image row
+    np.testing.assert_array_equal(image[0, 4], colorize(np.array([[1.0]]))[0, 0])
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from raster import decode_surface, encode_surface, rasterize, surface_cell_size, surface_grid
+from spatial import build_grid
+
+
+@pytest.fixture
+def surface():
+    """A district-like surface: the grid points inside a disc, with a hole, and smooth weights."""
+    grid_coords = build_grid((35.68, 51.30, 35.78, 51.40), 0.001)
+    offset = grid_coords - [35.73, 51.35]
+    distance = np.hypot(*offset.T)
+    keep = (distance < 0.05) & (distance > 0.01)
+    return grid_coords[keep], np.exp(-distance[keep] * 40)
+
+
+def sort_points(locations, weights):
+    order = np.lexsort((locations[:, 1], locations[:, 0]))
+    return locations[order], weights[order]
+
+
+def test_round_trip(surface):
+    locations, weights = surface
+    blob = encode_surface(locations, weights, 0.001)
+    decoded_locations, decoded_weights = decode_surface(blob)
+
+    expected_locations, expected_weights = sort_points(locations, weights)
+    decoded_locations, decoded_weights = sort_points(decoded_locations, decoded_weights)
+    np.testing.assert_allclose(decoded_locations, expected_locations, atol=1e-9)
+    np.testing.assert_array_equal(decoded_weights, expected_weights.astype(np.float32))
+    assert surface_cell_size(blob) == 0.001
+    # Much smaller than the coordinates and weights as float64
+    assert len(blob) < locations.nbytes / 4
+
+
+def test_surface_grid_matches_rasterize(surface):
+    locations, weights = surface
+    origin, grid_size, grid = surface_grid(encode_surface(locations, weights, 0.001))
+    expected_origin, expected_grid = rasterize(locations, weights.astype(np.float32), 0.001)
+    np.testing.assert_allclose(origin, expected_origin)
+    assert grid_size == 0.001
+    np.testing.assert_array_equal(np.isnan(grid), np.isnan(expected_grid))
+    np.testing.assert_array_equal(grid[~np.isnan(grid)], expected_grid[~np.isnan(expected_grid)])
+
+
+def test_invalid_surfaces():
+    with pytest.raises(ValueError):
+        encode_surface(np.empty((0, 2)), np.empty(0), 0.001)
+    with pytest.raises(ValueError):
+        encode_surface(np.array([[35.7, 51.4], [35.7002, 51.4]]), np.array([0.5, 1.0]), 0.001)
+    with pytest.raises(ValueError):
+        decode_surface(b"XXXX" + encode_surface(np.array([[35.7, 51.4]]), np.array([1.0]), 0.001)[4:])
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import async_scrape
+from async_scrape import TokenBucket, scrape_cells_concurrently
+from checkpoints import ScrapeCheckpoint
+from http_cache import ResponseCache
+from locations import Location
+from replay_server import ReplayServer, record_response
+from scrape import adaptive_splitter, bundle_search_params, district_cells
+
+SLUG = "restaurant"
+SUB_CATEGORY = "رستوران"
+# (lat, lon) ring of a ~1.5 km square district
+DISTRICT = [(35.700, 51.400), (35.700, 51.416), (35.714, 51.416), (35.714, 51.400), (35.700, 51.400)]
+
+
+def bundle_payload(cell_index, places=2):
+    """A bundle search response with `places` places around a cell."""
+    tokens = [f"poi-{cell_index}-{place}" for place in range(places)]
+    features = [{"properties": {"name": f"Place {cell_index}-{place}", "rate": 4.0},
+                 "geometry": {"coordinates": [51.4 + cell_index / 1000, 35.7 + place / 1000]}}
+                for place in range(places)]
+    return {"poi-tokens": tokens, "geojson": {"features": features}}
+
+
+@pytest.fixture
+def cells():
+    cells, _ = district_cells(DISTRICT)
+    return cells
+
+
+@pytest.fixture
+def recordings(tmp_path, cells):
+    """Recorded responses for every cell but the last, which the replay server answers with a 404."""
+    directory = tmp_path / "recordings"
+    for index, cell in enumerate(cells[:-1]):
+        record_response(directory, bundle_search_params(SLUG, '', SUB_CATEGORY, cell["centroid"]), bundle_payload(index))
+    return directory
+
+
+@pytest.fixture
+def stored(monkeypatch, tmp_path):
+    """Rows written through Location.bulk_add, which is replaced so no database is needed."""
+    rows = []
+    tokens = set()
+
+    def bulk_add(cls, session, batch, batch_size=1000):
+        new = [row for row in batch if row["token"] not in tokens]
+        tokens.update(row["token"] for row in new)
+        rows.extend(new)
+        return len(new), len(batch) - len(new)
+
+    monkeypatch.setattr(Location, "bulk_add", classmethod(bulk_add))
+    monkeypatch.setattr(async_scrape, "response_cache", ResponseCache(tmp_path / "cache"))
+    return rows
+
+
+def test_token_bucket_rate():
+    async def take(bucket, count):
+        start = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # The first `capacity` tokens are a burst, the rest arrive at `rate` per second
+    assert asyncio.run(take(TokenBucket(rate=20, capacity=5), 5)) < 0.1
+    assert asyncio.run(take(TokenBucket(rate=20, capacity=5), 15)) >= 10 / 20 * 0.95
+
+
+def test_concurrent_scrape_against_replay_server(cells, recordings, stored):
+    rate = 10
+    with ReplayServer(recordings) as replay:
+        start = time.monotonic()
+        search_results, stats = scrape_cells_concurrently(None, cells, SLUG, "food", SUB_CATEGORY,
+                                                          base_url=replay.base_url, concurrency=4, rate=rate)
+        elapsed = time.monotonic() - start
+
+    assert len(cells) > rate
+    expected_tokens = {f"poi-{index}-{place}" for index in range(len(cells) - 1) for place in range(2)}
+    assert {row["token"] for row in stored} == expected_tokens
+    assert stats == {"inserted": len(expected_tokens), "skipped": 0}
+    assert len(search_results) == len(expected_tokens)
+    assert all(row["category"] == "food" and row["subcategory"] == SUB_CATEGORY for row in stored)
+    assert next(row for row in stored if row["token"] == "poi-0-1")["geom"] == "SRID=4326;POINT(35.701 51.4)"
+    # One request per cell: a burst of `rate` requests, then `rate` per second
+    assert elapsed >= (len(cells) - rate) / rate * 0.95
+
+
+def test_concurrent_scrape_writes_each_response_off_the_event_loop(cells, recordings, stored, monkeypatch):
+    writes = []
+    bulk_add = Location.bulk_add
+
+    def recording_bulk_add(cls, session, batch, batch_size=1000):
+        with pytest.raises(RuntimeError):
+            asyncio.get_running_loop()  # Not on the event loop's thread
+        writes.append(len(batch))
+        return bulk_add(session, batch, batch_size)
+
+    monkeypatch.setattr(Location, "bulk_add", classmethod(recording_bulk_add))
+    with ReplayServer(recordings) as replay:
+        scrape_cells_concurrently(None, cells, SLUG, "food", SUB_CATEGORY, base_url=replay.base_url, concurrency=4,
+                                  rate=100)
+    # One write per response with places (the last cell answers 404)
+    assert writes == [2] * (len(cells) - 1)
+
+
+def test_adaptive_splitter():
+    cells, large_polygon = district_cells(DISTRICT, 1000)
+    split = adaptive_splitter(large_polygon, result_cap=3, min_meters=250)
+    cell = cells[0]
+
+    assert split(cell, bundle_payload(0, places=2)) == []
+    quadrants = split(cell, bundle_payload(0, places=3))
+    assert 0 < len(quadrants) <= 4
+    assert all(quadrant["meters"] == 500 for quadrant in quadrants)
+    assert all(large_polygon.covers(quadrant["polygon"]) for quadrant in quadrants)
+    assert abs(sum(quadrant["polygon"].area for quadrant in quadrants) - cell["polygon"].area) < 1e-12
+    # Quadrants are split again until the next level would be under min_meters
+    assert len(split(quadrants[0], bundle_payload(0, places=3))) > 0
+    assert split({**quadrants[0], "meters": 250}, bundle_payload(0, places=3)) == []
+
+
+def test_adaptive_splitter_drops_quadrants_outside_the_district():
+    cells, large_polygon = district_cells([(35.700, 51.400), (35.700, 51.416), (35.714, 51.400), (35.700, 51.400)],
+                                          2000)
+    split = adaptive_splitter(large_polygon, result_cap=1, min_meters=125)
+    # The triangle leaves out the quadrant in the corner opposite its right angle
+    assert len(split(cells[0], bundle_payload(0, places=1))) == 3
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_interrupted_concurrent_scrape_resumes(tmp_path, cells, recordings, stored):
+    def interrupt_after(count):
+        def progress(done, total, search_results):
+            if done == count:
+                raise Interrupted()
+        return progress
+
+    with ReplayServer(recordings) as replay:
+        checkpoint = ScrapeCheckpoint(1, SLUG, directory=tmp_path / "checkpoints", save_every=2)
+        with pytest.raises(Interrupted):
+            scrape_cells_concurrently(None, cells, SLUG, "food", SUB_CATEGORY, base_url=replay.base_url,
+                                      concurrency=2, rate=100, progress=interrupt_after(5), checkpoint=checkpoint)
+
+        resumed = ScrapeCheckpoint(1, SLUG, directory=tmp_path / "checkpoints", save_every=2)
+        assert len(resumed.completed) == 4  # Saved every 2 cells, the 5th was not saved yet
+        fetched = []
+        scrape_cells_concurrently(None, cells, SLUG, "food", SUB_CATEGORY, base_url=replay.base_url, concurrency=2,
+                                  rate=100, progress=lambda done, total, search_results: fetched.append(done),
+                                  checkpoint=resumed)
+        assert len(fetched) == len(cells) - 4
+
+        # Without a refresh window every completed cell is skipped, --reset scrapes them all again
+        again = ScrapeCheckpoint(1, SLUG, directory=tmp_path / "checkpoints")
+        assert again.pending(cells) == []
+        again.reset()
+        assert len(again.pending(cells)) == len(cells)
+
+    # The cells stored before the interruption and the resumed ones together cover the district
+    expected_tokens = {f"poi-{index}-{place}" for index in range(len(cells) - 1) for place in range(2)}
+    assert {row["token"] for row in stored} == expected_tokens
+
+
+def test_refreshed_cells_bypass_older_cached_responses(tmp_path, cells, recordings, stored):
+    # Every cell was answered 2 hours ago with an empty response, still within BUNDLE_SEARCH_CACHE_TTL
+    cache = async_scrape.response_cache
+    with ReplayServer(recordings) as replay:
+        for cell in cells:
+            cache.put(replay.base_url, bundle_search_params(SLUG, '', SUB_CATEGORY, cell["centroid"]), {})
+        two_hours_ago = time.time() - 7200
+        for entry in cache.entries():
+            os.utime(entry, (two_hours_ago, two_hours_ago))
+
+        checkpoint = ScrapeCheckpoint(1, SLUG, refresh_after=3600, directory=tmp_path / "checkpoints")
+        before = cache.stats()
+        scrape_cells_concurrently(None, cells, SLUG, "food", SUB_CATEGORY, base_url=replay.base_url, concurrency=4,
+                                  rate=100, checkpoint=checkpoint)
+
+    assert cache.stats(since=before) == {"hits": 0, "misses": len(cells)}
+    assert len(stored) == 2 * (len(cells) - 1)
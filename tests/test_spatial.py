@@ -0,0 +1,86 @@
+import numpy as np
+from shapely.geometry import Point, Polygon, box
+
+from spatial import buffer_mask, build_grid, grid_components, grid_mask, group_peaks
+
+DISTRICT = Polygon([(35.70, 51.30), (35.74, 51.31), (35.75, 51.36), (35.71, 51.37), (35.69, 51.33)])
+BANNED = [box(35.71, 51.32, 35.72, 51.34), Polygon([(35.73, 51.33), (35.76, 51.35), (35.72, 51.36)])]
+
+
+def loop_mask(grid_coords, district_polygon, banned_polys):
+    """The original per-point loop of kde_module."""
+    return np.array([
+        district_polygon.contains(Point(lat, lon)) and not any(zone.contains(Point(lat, lon)) for zone in banned_polys)
+        for lat, lon in grid_coords
+    ])
+
+
+def test_grid_mask_matches_point_loop():
+    grid_coords = build_grid(DISTRICT.bounds, 0.001)
+    mask = grid_mask(grid_coords, DISTRICT, BANNED)
+    assert mask.any() and not mask.all()
+    np.testing.assert_array_equal(mask, loop_mask(grid_coords, DISTRICT, BANNED))
+
+
+def test_grid_mask_without_banned_zones():
+    grid_coords = build_grid(DISTRICT.bounds, 0.002)
+    np.testing.assert_array_equal(grid_mask(grid_coords, DISTRICT, []), loop_mask(grid_coords, DISTRICT, []))
+
+
+def test_grid_mask_everything_banned():
+    grid_coords = build_grid(DISTRICT.bounds, 0.002)
+    assert not grid_mask(grid_coords, DISTRICT, [DISTRICT.buffer(0.01)]).any()
+
+
+def test_buffer_mask_matches_cdist_scan():
+    from scipy.spatial.distance import cdist
+
+    rng = np.random.default_rng(1)
+    coords = 35.7 + rng.random((300, 2)) * 0.05
+    candidates = 35.7 + rng.random((2000, 2)) * 0.05
+    expected = np.all(cdist(candidates, coords) >= 0.003, axis=1)
+    np.testing.assert_array_equal(buffer_mask(candidates, coords, 0.003), expected)
+
+
+def test_buffer_mask_without_candidates():
+    assert buffer_mask(np.empty((0, 2)), np.array([[35.7, 51.4]]), 0.005).shape == (0,)
+
+
+def loop_peaks(labels, weights):
+    """The original dict/max loop of cluster_points, returning point indices instead of points."""
+    clusters = {}
+    for i, label in enumerate(labels):
+        clusters.setdefault(label, []).append((i, weights[i]))
+    return [max(members, key=lambda x: x[1])[0] for label, members in clusters.items() if label != -1]
+
+
+def test_group_peaks_matches_loop():
+    rng = np.random.default_rng(2)
+    for _ in range(200):
+        size = rng.integers(1, 60)
+        labels = rng.integers(-1, 6, size)
+        weights = rng.integers(0, 4, size) / 4  # Few distinct values, so ties are common
+        assert group_peaks(labels, weights).tolist() == loop_peaks(labels, weights)
+
+
+def test_group_peaks_ties_noise_and_empty():
+    # Ties go to the first point of the cluster, and clusters come in order of first appearance
+    assert group_peaks([2, 0, 2, 0], [1.0, 0.5, 1.0, 0.5]).tolist() == [0, 1]
+    assert group_peaks([-1, -1, -1], [0.1, 0.9, 0.5]).tolist() == []
+    assert group_peaks([], []).tolist() == []
+
+
+def test_grid_components_connect_edge_and_diagonal_neighbours():
+    step = 0.001
+    points = 35.7 + np.array([
+        [0, 0], [0, 1],  # Edge neighbours
+        [1, 2],  # Diagonal neighbour of [0, 1]
+        [4, 4],  # Two cells away from everything
+        [6, 0], [7, 1],  # Diagonal pair
+    ]) * step
+    labels = grid_components(points, step)
+    assert labels[0] == labels[1] == labels[2]
+    assert labels[4] == labels[5]
+    assert len({labels[0], labels[3], labels[4]}) == 3
+    assert labels.min() == 0
+    assert grid_components(np.empty((0, 2)), step).shape == (0,)